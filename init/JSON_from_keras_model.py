@@ -20,9 +20,17 @@
 
 import json
 import numpy as np
+from pathlib import Path
 from numpyencoder import NumpyEncoder
 
-def JSON_from_keras_model(keras_model, output_dir_json):
+def JSON_from_keras_model(keras_model, output_dir_json, weights_format='inline'):
+    # weights_format selects where the layer parameters are stored:
+    #   'inline': nested lists in the JSON file
+    #   'npy':    one .npy file per array in a <model>_weights directory, memory-mapped when loaded
+    #   'npz':    a single <model>.npz archive next to the JSON file
+    json_path = Path(output_dir_json)
+    sidecar_arrays = {}
+
     model_json = keras_model.to_json()
     model_dict =  json.loads(model_json)
 
@@ -59,10 +67,30 @@ def JSON_from_keras_model(keras_model, output_dir_json):
         layer_json['config']['output_shape'] = output_shape
 
         if layer_json['class_name'] == 'Dense' or layer_json['class_name'] == 'Conv2D' :
-            layer_json['weights'] = np.float32(layer_keras.get_weights()[0])
-            layer_json['biases'] = np.float32(layer_keras.get_weights()[1])
+            for key, array in zip(('weights', 'biases'), layer_keras.get_weights()):
+                array = np.float32(array)
+                if weights_format == 'inline':
+                    layer_json[key] = array
+                elif weights_format == 'npy':
+                    sidecar_file = Path(json_path.stem + '_weights') / (layer_json['config']['name'] + '_' + key + '.npy')
+                    sidecar_arrays[sidecar_file] = array
+                    layer_json[key] = {'file': sidecar_file.as_posix()}
+                elif weights_format == 'npz':
+                    array_key = layer_json['config']['name'] + '/' + key
+                    sidecar_arrays[array_key] = array
+                    layer_json[key] = {'file': json_path.stem + '.npz', 'key': array_key}
+                else:
+                    raise ValueError("Unknown weights format " + str(weights_format))
             i = i + 2
 
+    if weights_format == 'npy':
+        for sidecar_file, array in sidecar_arrays.items():
+            (json_path.parent / sidecar_file).parent.mkdir(parents=True, exist_ok=True)
+            np.save(json_path.parent / sidecar_file, array)
+    elif weights_format == 'npz':
+        # Stored uncompressed, so that loading is a plain read of the arrays
+        np.savez(json_path.with_suffix('.npz'), **sidecar_arrays)
+
     with open(output_dir_json, 'w', encoding='utf-8') as f:
         json.dump(model_dict, f, indent=4, cls = NumpyEncoder)
     f.close()
@@ -21,10 +21,66 @@
 import numpy as np
 from abc import ABC, abstractmethod
 
+from .layers import format_c_literals
+
+
+def rational_tanh(x, t, data_type):
+    """Returns the C statements computing t = tanh(x) by a rational approximation (odd polynomial of degree 13 over
+    an even polynomial of degree 6), on x clamped to [-7.905311, 7.905311] where tanh rounds to +-1 in float.
+
+    x is overwritten, t is declared by the caller. The constants are float literals for float code, so that the
+    approximation is not evaluated in double.
+    """
+    f = 'f' if data_type == 'float' else ''
+    numerator = ['-2.76076847742355e-16', '2.00018790482477e-13', '-8.60467152213735e-11', '5.12229709037114e-08',
+                 '1.48572235717979e-05', '6.37261928875436e-04', '4.89352455891786e-03']
+    denominator = ['1.19825839466702e-06', '1.18534705686654e-04', '2.26843463243900e-03', '4.89352518554385e-03']
+
+    s = f"    if ({x} > 7.90531110763549805{f}) {x} = 7.90531110763549805{f};\n"
+    s += f"    if ({x} < -7.90531110763549805{f}) {x} = -7.90531110763549805{f};\n"
+    s += f"    {t} = {x}*{x};\n"
+    p = numerator[0] + f
+    for c in numerator[1:]:
+        p = f"({p}*{t} + {c}{f})"
+    q = denominator[0] + f
+    for c in denominator[1:]:
+        q = f"({q}*{t} + {c}{f})"
+    s += f"    {t} = {x}*{p}/{q};\n"
+
+    return s
+
+
+def rational_tanh_values(x, dtype):
+    """Evaluates the rational approximation of rational_tanh on the array x, with the operations of the generated code
+    in dtype.
+    """
+    numerator = [-2.76076847742355e-16, 2.00018790482477e-13, -8.60467152213735e-11, 5.12229709037114e-08,
+                 1.48572235717979e-05, 6.37261928875436e-04, 4.89352455891786e-03]
+    denominator = [1.19825839466702e-06, 1.18534705686654e-04, 2.26843463243900e-03, 4.89352518554385e-03]
+
+    x = np.clip(np.asarray(x, dtype=dtype), dtype(-7.90531110763549805), dtype(7.90531110763549805))
+    t = x*x
+    p = dtype(numerator[0])
+    for c in numerator[1:]:
+        p = p*t + dtype(c)
+    q = dtype(denominator[0])
+    for c in denominator[1:]:
+        q = q*t + dtype(c)
+
+    return x*p/q
+
 
 class ActivationFunctions():
-    def __init__(self):
+    # Implementations of the function which can be generated: exact (libm), rational or polynomial
+    # approximation (approx), linear interpolation in a table (lut)
+    implementations = ('libm',)
+
+    def __init__(self, implementation = 'libm'):
         self.name = ''
+        if implementation not in ('libm', 'approx', 'lut'):
+            raise ValueError("Unknown activation function implementation: " + implementation)
+        # The functions which are exact and cheap (relu, linear) are always generated as is
+        self.implementation = implementation if implementation in self.implementations else 'libm'
 
     @abstractmethod
     def compute(self, value):
@@ -38,39 +94,122 @@ class ActivationFunctions():
     def generate_c_definition(self, data_type):
         pass
 
-    def generate_activation_c_files(self, data_type, activation_source_file, activation_header_file):
-        activation_source_file.write(self.generate_c_definition(data_type))
-        activation_header_file.write(self.generate_c_declaration(data_type))
+    def generate_c_inline_definition(self, data_type):
+        # Defined in the header, so that the kernels can inline the activation
+        return self.generate_c_table(data_type) + "static inline " + self.generate_c_definition(data_type)
+
+    def generate_c_table(self, data_type):
+        # Table of the lut implementation, defined with the function
+        return ''
+
+    def generate_activation_c_files(self, data_type, activation_header_file):
+        # The functions are static inline, activation_functions.h is the only file defining them
+        activation_header_file.write(self.generate_c_inline_definition(data_type))
 
     @abstractmethod
     def write_activation_str(self, local_var):
         pass
 
+    def write_activation_call(self, local_var):
+        return f"{self.name}({local_var})"
+
+
+class TabulatedActivationFunction(ActivationFunctions):
+    # Function of the lut implementation, given by table_size values over [table_start, table_end] and constant
+    # outside of it
+    implementations = ('libm', 'approx', 'lut')
+    table_start = 0
+    table_end = 0
+    table_size = 1025
+
+    def generate_c_table(self, data_type):
+        if self.implementation != 'lut':
+            return ''
+        table = self.compute(np.linspace(self.table_start, self.table_end, self.table_size)).astype(np.float32 if data_type == 'float' else np.float64)
+        return f"static const {data_type} {self.name}_table[{self.table_size}] = {{{format_c_literals(table)}}};\n\n"
+
+    def generate_lut_body(self, data_type):
+        scale = str((self.table_size - 1)/(self.table_end - self.table_start)) + ('f' if data_type == 'float' else '')
+        s = f"    t = (x - ({self.table_start}))*{scale};\n"
+        s += f"    if (t <= 0)\n        return {self.name}_table[0];\n"
+        s += f"    if (t >= {self.table_size - 1})\n        return {self.name}_table[{self.table_size - 1}];\n"
+        s += "    k = (int)t;\n"
+        s += f"    return {self.name}_table[k] + (t - k)*({self.name}_table[k + 1] - {self.name}_table[k]);\n"
+        return s
 
-class Sigmoid(ActivationFunctions):
+    def lut_values(self, x, dtype):
+        # Evaluates the linear interpolation of generate_lut_body on the array x, in dtype
+        table = self.compute(np.linspace(self.table_start, self.table_end, self.table_size)).astype(dtype)
+        t = (np.asarray(x, dtype=dtype) - dtype(self.table_start))*dtype((self.table_size - 1)/(self.table_end - self.table_start))
+        k = np.clip(t, 0, self.table_size - 2).astype(int)
+        values = table[k] + (t - k.astype(dtype))*(table[k + 1] - table[k])
+        values[t <= 0] = table[0]
+        values[t >= self.table_size - 1] = table[-1]
+        return values
+
+    @abstractmethod
+    def approx_values(self, x, dtype):
+        pass
+
+    def max_error(self, data_type, nb_points = 1 << 20):
+        """Returns the largest absolute difference between the generated implementation, evaluated in data_type, and
+        the exact function, over a grid of nb_points values covering twice the table range (both saturations).
+        """
+        dtype = np.float32 if data_type == 'float' else np.float64
+        x = np.linspace(2*self.table_start, 2*self.table_end, nb_points).astype(dtype)
+        if self.implementation == 'lut':
+            values = self.lut_values(x, dtype)
+        elif self.implementation == 'approx':
+            values = self.approx_values(x, dtype)
+        else:
+            values = self.compute(x)
+        return float(np.max(np.abs(values.astype(np.float64) - self.compute(x.astype(np.float64)))))
+
+    def write_activation_str(self, local_var):
+        # The approximations are functions defined with the generated code
+        if self.implementation != 'libm':
+            return self.write_activation_call(local_var)
+        return self.write_libm_str(local_var)
+
+    @abstractmethod
+    def write_libm_str(self, local_var):
+        pass
+
+
+class Sigmoid(TabulatedActivationFunction):
+    table_start = -16
+    table_end = 16
     
-    def __init__(self):
-        super().__init__()
+    def __init__(self, implementation = 'libm'):
+        super().__init__(implementation)
         self.name = 'sigmoid'
         #self.layer_type
 
     def compute(self, z):
         return 1/(1+np.exp(-z))
 
+    def approx_values(self, x, dtype):
+        return (1 + rational_tanh_values(np.asarray(x, dtype=dtype)/2, dtype))/2
+
     def generate_c_declaration(self, data_type):
         return f"{data_type} sigmoid({data_type});\n"
 
     def generate_c_definition(self, data_type):
+        if self.implementation == 'approx':
+            # sigmoid(x) = (1 + tanh(x/2))/2
+            return f"{data_type} sigmoid ({data_type} x)\n{{\n    {data_type} t;\n\n    x = x/2;\n{rational_tanh('x', 't', data_type)}    return (1 + t)/2;\n}}\n\n"
+        elif self.implementation == 'lut':
+            return f"{data_type} sigmoid ({data_type} x)\n{{\n    {data_type} t;\n    int k;\n\n{self.generate_lut_body(data_type)}}}\n\n"
         return f"{data_type} sigmoid ({data_type} x)\n{{\n    return 1 / (1 + exp(-x));\n}}\n\n"
 
-    def write_activation_str(self, local_var):
+    def write_libm_str(self, local_var):
         return f"1 / (1 + exp(-{local_var}))"
 
 
 class ReLu(ActivationFunctions):
     
-    def __init__(self):
-        super().__init__()
+    def __init__(self, implementation = 'libm'):
+        super().__init__(implementation)
         self.name = 'relu'
     
     def compute(self, z):
@@ -86,27 +225,37 @@ class ReLu(ActivationFunctions):
         return f"{local_var} > 0 ? {local_var} : 0" # output = condition ? value_if_true : value_if_false
 
 
-class TanH(ActivationFunctions):
-    def __init__(self):
-        super().__init__()
+class TanH(TabulatedActivationFunction):
+    table_start = -8
+    table_end = 8
+
+    def __init__(self, implementation = 'libm'):
+        super().__init__(implementation)
         self.name = 'hyperb_tan'
 
     def compute(self, z):
-        return (np.exp(z)-np.exp(-z))/(np.exp(z)+np.exp(-z))
+        return np.tanh(z)
+
+    def approx_values(self, x, dtype):
+        return rational_tanh_values(x, dtype)
 
     def generate_c_declaration(self, data_type):
         return f"{data_type} hyperb_tan({data_type} x);\n"
 
     def generate_c_definition(self, data_type):
-        return f"{data_type} hyperb_tan ({data_type} x)\n{{\n    return (exp(x)-exp(-x))/(exp(x)+exp(-x));\n}}\n\n"
+        if self.implementation == 'approx':
+            return f"{data_type} hyperb_tan ({data_type} x)\n{{\n    {data_type} t;\n\n{rational_tanh('x', 't', data_type)}    return t;\n}}\n\n"
+        elif self.implementation == 'lut':
+            return f"{data_type} hyperb_tan ({data_type} x)\n{{\n    {data_type} t;\n    int k;\n\n{self.generate_lut_body(data_type)}}}\n\n"
+        return f"{data_type} hyperb_tan ({data_type} x)\n{{\n    return tanh(x);\n}}\n\n"
 
-    def write_activation_str(self, local_var):
-        return f"(exp({local_var})-exp(-{local_var}))/(exp({local_var})+exp(-{local_var}))"
+    def write_libm_str(self, local_var):
+        return f"tanh({local_var})"
 
 
 class Linear(ActivationFunctions):
-    def __init__(self):
-        super().__init__()
+    def __init__(self, implementation = 'libm'):
+        super().__init__(implementation)
         self.name = 'linear'
     
     def compute(self, z):
@@ -21,10 +21,11 @@
 import argparse
 import numpy as np
 from acetone.neural_network import CodeGenerator_V1, CodeGenerator_V2, CodeGenerator_V3, CodeGenerator_V4, \
-    TemplatedCodeGenerator, MmaTemplatedCodeGenerator, GpuMmaTemplatedCodeGenerator
+    TemplatedCodeGenerator, MmaTemplatedCodeGenerator, GpuMmaTemplatedCodeGenerator, GemmCodeGenerator, \
+    Int8CodeGenerator
 
 
-def main(model_file, test_dataset_file, function_name, nb_tests, version, output_dir, force=False, variant=None):
+def main(model_file, test_dataset_file, function_name, nb_tests, version, output_dir, force=False, variant=None, cross_check=False, batch_size=256, jobs=1, output_format='txt', binary_dataset=False, specialized=False, filter_block=None, simd=None, openmp=False, batch_block=None, fuse_pooling=False, fuse_softmax=False, activation_impl='libm'):
 
     print("CODE GENERATOR FOR NEURAL NETWORKS")
 
@@ -35,6 +36,8 @@ def main(model_file, test_dataset_file, function_name, nb_tests, version, output
                         'v5' : TemplatedCodeGenerator,
                         'v6' : MmaTemplatedCodeGenerator,
                         'v7' : GpuMmaTemplatedCodeGenerator,
+                        'v8' : GemmCodeGenerator,
+                        'v9' : Int8CodeGenerator,
                         }
 
     codegen_class = version_mapping[version]
@@ -45,9 +48,19 @@ def main(model_file, test_dataset_file, function_name, nb_tests, version, output
         function_name = function_name,
         nb_tests = nb_tests,
         variant = variant,
+        cross_check = cross_check,
+        binary_dataset = binary_dataset,
+        specialized = specialized,
+        filter_block = filter_block,
+        simd = simd,
+        openmp = openmp,
+        batch_block = batch_block,
+        fuse_pooling = fuse_pooling,
+        fuse_softmax = fuse_softmax,
+        activation_impl = activation_impl,
     )
     net.generate_c_files(output_dir, force=force)
-    net.compute_inference(output_dir)
+    net.compute_inference(output_dir, batch_size=batch_size, jobs=jobs, output_format=output_format)
 
 
 def cli():
@@ -60,11 +73,24 @@ def cli():
     parser.add_argument("version", help="Version to be used for the code generation")
     parser.add_argument("output_dir", help="Output directory where generated files will be written")
     parser.add_argument("-f", "--force", help="Overwrite existing files", action="store_true")
+    parser.add_argument("--binary-dataset", help="Read the test inputs from test_dataset.bin at runtime instead of compiling them in the harness", action="store_true")
     parser.add_argument("--variant", help="Generator code variant")
+    parser.add_argument("--specialized", help="Instantiate the templated layer kernels with compile-time parameters (v5 and v6)", action="store_true")
+    parser.add_argument("--filter-block", help="Pack the convolution filters by blocks of FILTER_BLOCK and compute each block at once (v2)", type=int)
+    parser.add_argument("--simd", help="Write the Dense, Conv2D and pooling kernels with vectors of SIMD elements, e.g. 4 floats for SSE/NEON or 8 for AVX (v2)", type=int)
+    parser.add_argument("--openmp", help="Share the loops of the layer kernels between OpenMP threads, their number is set at runtime by OMP_NUM_THREADS", action="store_true")
+    parser.add_argument("--batch-block", help="Also generate inference_batch(predictions, inputs, n), which computes each layer over blocks of BATCH_BLOCK samples (v8)", type=int)
+    parser.add_argument("--fuse-pooling", help="Compute each Conv2D and the pooling layer following it by a single kernel, without storing the output of the convolution (v2, v8)", action="store_true")
+    parser.add_argument("--fuse-softmax", help="Compute each Dense layer and the Softmax following it by a single kernel (v2, v8)", action="store_true")
+    parser.add_argument("--activation-impl", help="Implementation of the sigmoid and tanh activations: libm (exact), approx (rational approximation) or lut (interpolated table), for all of them or per activation, e.g. tanh=lut,sigmoid=approx. The maximum error against libm printed by the generator is, in float, 3.5e-07 (tanh) and 1.96e-07 (sigmoid) for approx, 2.36e-05 (tanh) and 1.18e-05 (sigmoid) for lut. The reference inference stays exact, so that the semantic preservation tool reports the error of the implementation", default='libm')
+    parser.add_argument("--cross-check", help="Check the reference convolutions against the tiled (MMA) emulation", action="store_true")
+    parser.add_argument("--batch-size", help="Number of samples computed at once by the reference inference", type=int, default=256)
+    parser.add_argument("-j", "--jobs", help="Number of processes computing the reference inference", type=int, default=1)
+    parser.add_argument("--output-format", help="Format of the reference inference output: text, .npy or raw binary. Default is txt", choices=["txt", "npy", "bin"], default="txt")
 
     args = parser.parse_args()
 
-    main(args.model_file, args.test_dataset_file, args.function_name, args.nb_tests, args.version, args.output_dir, args.force, args.variant)
+    main(args.model_file, args.test_dataset_file, args.function_name, args.nb_tests, args.version, args.output_dir, args.force, args.variant, args.cross_check, args.batch_size, args.jobs, args.output_format, args.binary_dataset, args.specialized, args.filter_block, args.simd, args.openmp, args.batch_block, args.fuse_pooling, args.fuse_softmax, args.activation_impl)
 
     
 if __name__ == "__main__":
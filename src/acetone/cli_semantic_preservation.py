@@ -45,6 +45,8 @@ def preprocess_line(line, precision):
         line = list(map(np.float64,line))
     elif precision == 'float':
         line = list(map(np.float32,line))  
+    elif precision == 'int8':
+        line = list(map(int,line))
     return line 
 
 def compare_lines(line_f1, line_f2, precision):
@@ -93,8 +95,58 @@ def compare_files(file1, file2, nb_tests, precision):
     else: 
         return False, max_diff_file
 
+def is_binary_file(file):
+    return file.endswith('.npy') or file.endswith('.bin')
+
+
+def output_dtype(precision):
+    # Type of the values written by the generated code for the given precision
+    if precision == 'double':
+        return np.float64
+    elif precision == 'int8':
+        return np.int8
+    return np.float32
+
+
+def load_outputs(file, nb_tests, precision, output_size=None):
+    # .npy files are memory-mapped, .bin files contain the raw values in the given precision
+    dtype = output_dtype(precision)
+    if file.endswith('.npy'):
+        outputs = np.load(file, mmap_mode='r')
+    elif file.endswith('.bin'):
+        outputs = np.fromfile(file, dtype=dtype)
+        outputs = outputs.reshape(-1, output_size if output_size else len(outputs) // int(nb_tests))
+    else:
+        outputs = np.loadtxt(file, dtype=dtype, max_rows=int(nb_tests), ndmin=2)
+    return np.asarray(outputs[:int(nb_tests)], dtype=dtype)
+
+
+def compare_arrays(outputs1, outputs2, epsilon = (128*sys.float_info.epsilon), abs_th = sys.float_info.min):
+    # Vectorised compare_floats over all the outputs
+    diff = np.abs(outputs1 - outputs2)
+    norm = np.minimum(np.abs(outputs1) + np.abs(outputs2), sys.float_info.max)
+    comparison = (outputs1 == outputs2) | (diff < np.maximum(abs_th, epsilon * norm))
+    return bool(np.all(comparison)), (diff.max() if diff.size else 0)
+
+
+def compare_binary_files(file1, file2, nb_tests, precision):
+    # Raw binary outputs take their row size from the other file when possible
+    outputs1 = None if file1.endswith('.bin') else load_outputs(file1, nb_tests, precision)
+    outputs2 = None if file2.endswith('.bin') else load_outputs(file2, nb_tests, precision)
+    if outputs1 is None:
+        outputs1 = load_outputs(file1, nb_tests, precision, None if outputs2 is None else outputs2.shape[1])
+    if outputs2 is None:
+        outputs2 = load_outputs(file2, nb_tests, precision, outputs1.shape[1])
+    # The int8 outputs are compared as integers in double, so that their difference cannot wrap around
+    dtype = np.float64 if precision in ('double', 'int8') else np.float32
+    return compare_arrays(outputs1.astype(dtype), outputs2.astype(dtype))
+
+
 def main(reference_file, c_file, nb_tests, precision):
-    _, max_diff_file = compare_files(reference_file, c_file, nb_tests, precision)
+    if is_binary_file(reference_file) or is_binary_file(c_file):
+        _, max_diff_file = compare_binary_files(reference_file, c_file, nb_tests, precision)
+    else:
+        _, max_diff_file = compare_files(reference_file, c_file, nb_tests, precision)
     
     print("   Max absolute error for %s test(s): %s" % (nb_tests, max_diff_file))
 
@@ -102,10 +154,10 @@ def main(reference_file, c_file, nb_tests, precision):
 def cli():
     parser = argparse.ArgumentParser(description='Program to verify the semantic preservation of ')
 
-    parser.add_argument("reference_file", help="File with the inference output of the reference machine learning framework")
-    parser.add_argument("c_file", help="File with the inference output of the studied machine learning framework")
+    parser.add_argument("reference_file", help="File with the inference output of the reference machine learning framework (text, .npy or raw .bin)")
+    parser.add_argument("c_file", help="File with the inference output of the studied machine learning framework (text, .npy or raw .bin)")
     parser.add_argument("nb_tests", help="Number of inferences process to compare")
-    parser.add_argument("--precision", help="Precision of the data studied. Default is float32")
+    parser.add_argument("--precision", help="Precision of the data studied: float, double or int8 (the outputs of the v9 code). Default is float32")
 
     args = parser.parse_args()
 
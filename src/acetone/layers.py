@@ -19,9 +19,10 @@
 """
 from __future__ import annotations
 
+import io
 import math
 import operator
-from functools import reduce
+from functools import reduce, lru_cache
 
 import numpy as np
 from abc import ABC, abstractmethod
@@ -29,6 +30,56 @@ from exo import proc
 from exo.syntax import size, f32, par
 
 
+def format_c_literals(array, order='C'):
+    """Returns the elements of an array as a comma separated list of C literals.
+
+    Floats are written with enough significant digits to round-trip exactly (9 for float32, 17 for float64),
+    float32 values carry the 'f' suffix so that the compiler rounds them directly to float.
+    """
+    flattened = np.ravel(array, order=order)
+    if flattened.dtype == np.float32:
+        literal = '%#.9gf'
+    elif flattened.dtype.kind == 'f':
+        literal = '%.17g'
+    else:
+        literal = '%d'
+    return ', '.join([literal] * flattened.size) % tuple(flattened.tolist())
+
+
+def affine_quantization(low, high):
+    """Returns the scale and zero point mapping the range [low, high] (extended to contain 0) on the int8 range.
+
+    The real value of an int8 q is scale*(q - zero_point), 0 being represented exactly by the zero point.
+    """
+    low, high = min(float(low), 0.0), max(float(high), 0.0)
+    scale = (high - low)/255 if high > low else 1.0
+    zero_point = int(np.clip(np.round(-128 - low/scale), -128, 127))
+    return scale, zero_point
+
+
+def quantize_multiplier(real_multiplier):
+    """Returns the multiplier m in [2^30, 2^31) and the shift n such that real_multiplier = m/2^n (up to rounding)."""
+    mantissa, exponent = math.frexp(real_multiplier)
+    multiplier = int(round(mantissa * (1 << 31)))
+    shift = 31 - exponent
+    if multiplier == 1 << 31:
+        multiplier, shift = multiplier // 2, shift - 1
+    if shift < 1:
+        raise ValueError(f"Requantization multiplier {real_multiplier} is too large for the int8 kernels.")
+    if shift > 62:
+        # Rounds to 0 in the generated code, as any multiplier this small
+        return 0, 62
+    return multiplier, shift
+
+
+def requantize(accumulator, multipliers, shifts):
+    """Computes round(accumulator*multipliers/2^shifts), the halves being rounded up, exactly as the generated code
+    (the product is computed on 64 bits, the shift of a negative value rounding towards minus infinity)."""
+    accumulator = np.asarray(accumulator, dtype=np.int64)
+    shifts = np.asarray(shifts, dtype=np.int64)
+    return (accumulator * multipliers + (np.int64(1) << (shifts - 1))) >> shifts
+
+
 class Layers(ABC):
     
     def __init__(self):
@@ -41,7 +92,29 @@ class Layers(ABC):
         self.globalvars_str = ''
         self.header_str = ''
         self.source_str = ''
-      
+        # Buffers read and written by the layer in the generated inference function
+        self.input_buffer = 'output_pre'
+        self.output_buffer = 'output_cur'
+        # Offset of the layer output in the activations arena
+        self.offset = 0
+        # Temporary buffer used while computing the layer, also placed in the activations arena
+        self.scratch_size = 0
+        self.scratch_offset = 0
+        # Number of elements of the vectors (vec_t) used by the V2 kernels, None for scalar kernels
+        self.simd = None
+        # Share the outer loop of the kernels between OpenMP threads
+        self.openmp = False
+        # Scale and zero point of the int8 output (real value = scale*(q - zero_point)), None for float layers
+        self.output_scale = None
+        self.output_zero_point = 0
+        # Requantization of the int32 accumulators of the int8 kernels, one multiplier and shift per output channel
+        self.requant_multipliers = None
+        self.requant_shifts = None
+        # int8 output for each int8 pre-activation (tanh and sigmoid), None if the accumulators are requantized
+        # directly to the output
+        self.activation_table = None
+        self.preactivation_zero_point = 0
+
         super().__init__()
 
     @abstractmethod
@@ -52,40 +125,129 @@ class Layers(ABC):
     def feedforward(self, input):
         pass
 
-    def flatten_array_orderc(self, array):
-    
-        flattened_aray = array.flatten(order='C')
-        s = '\n        {'
-        for i in range(flattened_aray.size):
-            s += str(flattened_aray[i])+', '
-        s = s[:-2]
-        s+='}'
-        
+    def kernel_name(self):
+        # The kernels of V1 are specialized for the activation function of the layer
+        if hasattr(self, 'activation_function'):
+            return self.name + '_' + self.activation_function.name
+        else:
+            return self.name
+
+    def layout_weights(self, weights=None):
+        # Weights (or an array of the same shape, e.g. the int8 weights) in the order in which the generated kernels read them
+        return self.weights if weights is None else weights
+
+    def quantize(self, output_range, preactivation_range=None):
+        # The layers without weights compute on the int8 values of their input, with the same scale and zero point
+        previous = self.previous_layer[0]
+        self.output_scale, self.output_zero_point = previous.output_scale, previous.output_zero_point
+
+    def quantize_weights(self, output_range, preactivation_range):
+        # Symmetric int8 weights with a scale per output channel (the last axis), int32 biases in the scale of the
+        # accumulators, which is the input scale times the weights scale
+        input_scale = self.previous_layer[0].output_scale
+        channels = self.weights.shape[-1]
+        weight_scales = np.max(np.abs(self.weights.reshape(-1, channels)), axis=0).astype(np.float64) / 127
+        weight_scales[weight_scales == 0] = 1.0
+        self.quantized_weights = np.clip(np.round(self.weights / weight_scales), -127, 127).astype(np.int8)
+        accumulator_scales = input_scale * weight_scales
+        self.quantized_biases = np.clip(np.round(self.biases / accumulator_scales), -2**31, 2**31 - 1).astype(np.int32)
+
+        if self.activation_function.name in ('hyperb_tan', 'sigmoid'):
+            # The accumulators are requantized to the int8 pre-activation, whose 256 values are mapped to the
+            # output by a table. The output range is fixed by the function: [-1, 1] for tanh, [0, 1] for sigmoid.
+            preactivation_scale, self.preactivation_zero_point = affine_quantization(*preactivation_range)
+            if self.activation_function.name == 'hyperb_tan':
+                self.output_scale, self.output_zero_point = 1/128, 0
+            else:
+                self.output_scale, self.output_zero_point = 1/256, -128
+            preactivation = preactivation_scale * (np.arange(-128, 128) - self.preactivation_zero_point)
+            outputs = np.round(self.activation_function.compute(preactivation) / self.output_scale) + self.output_zero_point
+            self.activation_table = np.clip(outputs, -128, 127).astype(np.int8)
+            target_scale = preactivation_scale
+        else:
+            self.output_scale, self.output_zero_point = affine_quantization(*output_range)
+            target_scale = self.output_scale
+
+        multipliers, shifts = zip(*(quantize_multiplier(scale / target_scale) for scale in accumulator_scales))
+        self.requant_multipliers = np.array(multipliers, dtype=np.int64)
+        self.requant_shifts = np.array(shifts, dtype=np.int64)
+
+    def quantized_activation(self, accumulators):
+        # int8 outputs of the int32 accumulators (channels on the last axis), as computed by write_requantization
+        zero_point = self.output_zero_point if self.activation_table is None else self.preactivation_zero_point
+        q = np.clip(requantize(accumulators, self.requant_multipliers, self.requant_shifts) + zero_point, -128, 127)
+        if self.activation_table is not None:
+            return self.activation_table[q + 128]
+        if self.activation_function.name == 'relu':
+            q = np.maximum(q, self.output_zero_point)
+        return q.astype(np.int8)
+
+    def write_requantization(self, indent, channel, output):
+        # Requantizes the accumulator acc of the output channel and stores the int8 activation in output
+        suffix = self.name + '_' + str("{:02d}".format(self.idx))
+        zero_point = self.output_zero_point if self.activation_table is None else self.preactivation_zero_point
+        s = indent + 'acc = saturate(requantize(acc, multipliers_' + suffix + '[' + channel + '], shifts_' + suffix + '[' + channel + ']) + (' + str(zero_point) + '));\n'
+        if self.activation_table is not None:
+            s += indent + output + ' = table_' + suffix + '[acc + 128];\n'
+        elif self.activation_function.name == 'relu':
+            s += indent + output + ' = acc > (' + str(self.output_zero_point) + ') ? acc : (' + str(self.output_zero_point) + ');\n'
+        else:
+            s += indent + output + ' = acc;\n'
         return s
-    
+
+    def quantized_parameters(self):
+        # Arrays read by the int8 kernels of the layer, as (C type, name, values)
+        if self.requant_multipliers is None:
+            return []
+        suffix = self.name + '_' + str("{:02d}".format(self.idx))
+        parameters = [('int8_t', 'weights_' + suffix, self.layout_weights(self.quantized_weights)),
+                      ('int32_t', 'biases_' + suffix, self.quantized_biases),
+                      ('int32_t', 'multipliers_' + suffix, self.requant_multipliers),
+                      ('int8_t', 'shifts_' + suffix, self.requant_shifts)]
+        if self.activation_table is not None:
+            parameters.append(('int8_t', 'table_' + suffix, self.activation_table))
+        return parameters
+
+    def write_batch_source(self, data_type, source_file, samples):
+        # By default the layer is computed sample by sample by its V8 code, the buffers of a block
+        # holding the samples one after the other
+        buffers = (self.input_buffer, self.output_buffer)
+        body = io.StringIO()
+        self.input_buffer, self.output_buffer = 'sample_input', 'sample_output'
+        self.write_to_function_source_file(data_type, 'v8', body)
+        self.input_buffer, self.output_buffer = buffers
+
+        source_file.write('    for (int s = 0; s < ' + samples + '; ++s)\n    {\n')
+        source_file.write('        ' + data_type + ' *sample_input = ' + buffers[0] + ' + s*' + str(self.previous_layer[0].size) + ';\n')
+        source_file.write('        ' + data_type + ' *sample_output = ' + buffers[1] + ' + s*' + str(self.size) + ';\n\n')
+        source_file.write(''.join('    ' + line if line.strip() else line for line in body.getvalue().rstrip('\n').splitlines(True)))
+        source_file.write('\n    }\n\n')
+
+    def parallel_for(self, indent, *private_vars, reduction=None):
+        # Each iteration of the loop computes its own outputs in the serial order, so that the result
+        # does not depend on the number of threads (the only reduction used, max, is exact in any order)
+        if not self.openmp:
+            return ''
+        s = indent + '#pragma omp parallel for schedule(static)'
+        if private_vars:
+            s += ' private(' + ', '.join(private_vars) + ')'
+        if reduction:
+            s += ' reduction(' + reduction + ')'
+        return s + '\n'
+
+    def flatten_array_orderc(self, array):
+
+        return '\n        {' + format_c_literals(array, order='C') + '}'
+
     def flatten_array_orderf(self, array):
-    
-        flattened_aray = array.flatten(order='F')
-        s = '\n        {'
-        for i in range(flattened_aray.size):
-            s += str(flattened_aray[i])+', '
-        s = s[:-2]
-        s+='}'
-        
-        return s
-    
+
+        return '\n        {' + format_c_literals(array, order='F') + '}'
+
     def flatten_array_hybrid(self, array):
         ndim = array.ndim
         array = array.reshape(-1, *array.shape[-(ndim-2):])
-        
-        flattened_aray = array.flatten(order='F')
-        s = '\n        {'
-        for i in range(flattened_aray.size):
-            s += str(flattened_aray[i])+', '
-        s = s[:-2]
-        s+='}'
-        
-        return s
+
+        return '\n        {' + format_c_literals(array, order='F') + '}'
 
     def count_elements_array(self, array):
         nb_elements = 1
@@ -96,8 +258,9 @@ class Layers(ABC):
         
         # Compute 'same' padding tensorflow
 
-        filter_height = (kernel_size - (kernel_size-1)*(dilation_rate-1))
-        filter_width = (kernel_size - (kernel_size-1)*(dilation_rate-1))
+        # Extent of the dilated kernel
+        filter_height = (kernel_size + (kernel_size-1)*(dilation_rate-1))
+        filter_width = (kernel_size + (kernel_size-1)*(dilation_rate-1))
 
         # The total padding applied along the height and width is computed as:
 
@@ -122,7 +285,7 @@ class Layers(ABC):
         keys = ['type', 'variable', 'bound', 'start', 'end', 'inner']
         
         function = {}
-        function['name'] = self.name
+        function['name'] = self.kernel_name()
         function['inner'] = []
 
         for dict, values_loop in zip(list_of_dicts, list_of_values_loops):
@@ -152,7 +315,7 @@ class Layers(ABC):
             keys = ['type', 'variable', 'bound', 'start', 'end', 'inner']
             
             function = {}
-            function['name'] = self.name
+            function['name'] = self.kernel_name()
             function['inner'] = []
 
             # Create dictionary for each loop present in function
@@ -193,10 +356,8 @@ class InputLayer(Layers):
 
     def write_to_function_source_file(self, data_type, version, source_file):
         
-        if version == 'v2':
-            source_file.write(  '    // ' + self.name + '_' + str(self.idx) + '\n')
-            source_file.write( '    for (int i = 0; i < ' + str(self.size) + '; ++i) \n    { \n')
-            source_file.write( '        output_pre[i] = nn_input[i]; \n    } \n\n')
+        if version == 'v2' or version == 'v8' or version == 'v9':
+            source_file.write(  '    // ' + self.name + '_' + str(self.idx) + '\n\n')
 
         elif version == 'v3':
             source_file.write(  '    // ' + self.name + '_' + str(self.idx) + '\n\n')
@@ -204,6 +365,9 @@ class InputLayer(Layers):
         else:
             pass
 
+    def write_batch_source(self, data_type, source_file, samples):
+        source_file.write(  '    // ' + self.name + '_' + str(self.idx) + '\n\n')
+
     def write_to_function_header_file(self, version, header_file):
         
         if version == 'v1' or version == 'v4':
@@ -239,6 +403,10 @@ class InputLayer(Layers):
 
         return 
 
+    def quantize(self, output_range, preactivation_range=None):
+        # The inputs are quantized by the caller, on the calibrated range of the dataset
+        self.output_scale, self.output_zero_point = affine_quantization(*output_range)
+
     def feedforward(self, input):
         
         return input 
@@ -273,55 +441,124 @@ class Dense(Layers):
         self.nb_weights = self.count_elements_array(self.weights)
         self.nb_biases = self.count_elements_array(self.biases)
 
+    def layout_weights(self, weights=None):
+        # Stored output-major, so that each dot product reads a contiguous row
+        return (self.weights if weights is None else weights).T
+
     def write_to_layer_c_files(self, data_type, version, layers_source_file, layers_header_file):
         
         if version == 'v1' or version == 'v4':
 
 
-            layers_source_file.write('int Dense(int layer_idx, ' + data_type + ' *input, '+ data_type + ' *output) \n{ \n')
+            layers_source_file.write('int ' + self.kernel_name() + '(int layer_idx, ' + data_type + ' *input, '+ data_type + ' *output) \n{ \n')
             layers_source_file.write('    '+ data_type + ' dotproduct;\n\n')
+            layers_source_file.write(self.parallel_for('    ', 'dotproduct'))
             layers_source_file.write('    for (int i = 0; i < net[layer_idx].layer_size; ++i) \n    { \n')
             layers_source_file.write('        dotproduct = 0;\n')
             layers_source_file.write('        for (int j = 0; j < net[layer_idx-1].layer_size; ++j)\n        {\n')
-            layers_source_file.write('            dotproduct += input[j] * (net[layer_idx].weights[(j*net[layer_idx].layer_size+i)]);\n        }\n')
+            layers_source_file.write('            dotproduct += input[j] * (net[layer_idx].weights[(i*net[layer_idx-1].layer_size+j)]);\n        }\n')
             layers_source_file.write('        dotproduct += net[layer_idx].biases[i];\n')
-            layers_source_file.write('        output[i] = net[layer_idx].actv_function(dotproduct);\n    }\n\n')
+            layers_source_file.write('        output[i] = ' + self.activation_function.write_activation_call('dotproduct') + ';\n    }\n\n')
             layers_source_file.write('    return 0; \n} \n\n')
             
-            layers_header_file.write('int Dense(int layer_idx, ' + data_type + ' *input, '+ data_type + ' *output);\n')
+            layers_header_file.write('int ' + self.kernel_name() + '(int layer_idx, ' + data_type + ' *input, '+ data_type + ' *output);\n')
         
     def write_to_function_source_file(self, data_type, version, source_file):
 
-        if version == 'v2':
+        if version == 'v2' and self.simd:
+            self.write_vector_dotproducts(source_file)
+
+        elif version == 'v2':
             source_file.write(  '    // ' + self.name + '_' + str(self.idx) + '\n')
+            source_file.write(self.parallel_for('    ', self.local_var))
             source_file.write( '    for (int i = 0; i < ' + str(self.size) + '; ++i) \n    { \n')
             source_file.write( '        dotproduct = 0;\n')
             source_file.write( '        for (int j = 0; j < ' + str(self.previous_layer[0].size) + '; ++j)\n        {\n')
-            source_file.write( '            dotproduct += output_pre[j] * weights_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[(i + ' + str(self.size) + '*j)];\n        }\n')
+            source_file.write( '            dotproduct += ' + self.input_buffer + '[j] * weights_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[(' + str(self.previous_layer[0].size) + '*i + j)];\n        }\n')
             source_file.write( '        dotproduct += biases_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[i];\n')
 
             a = self.activation_function.write_activation_str(self.local_var)
 
-            source_file.write( '        output_cur[i] = '+ a +';\n    }\n\n')
+            source_file.write( '        ' + self.output_buffer + '[i] = '+ a +';\n    }\n\n')
+
+        elif version == 'v8':
+            self.write_gemm_source(source_file)
+
+        elif version == 'v9':
+            input_size = self.previous_layer[0].size
+            input_zero_point = self.previous_layer[0].output_zero_point
+
+            source_file.write(  '    // ' + self.name + '_' + str(self.idx) + '\n')
+            source_file.write(self.parallel_for('    ', 'acc'))
+            source_file.write( '    for (int i = 0; i < ' + str(self.size) + '; ++i) \n    { \n')
+            source_file.write( '        acc = biases_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[i];\n')
+            source_file.write( '        for (int j = 0; j < ' + str(input_size) + '; ++j)\n')
+            source_file.write( '            acc += (' + self.input_buffer + '[j] - (' + str(input_zero_point) + ')) * weights_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[(' + str(input_size) + '*i + j)];\n')
+            source_file.write(self.write_requantization('        ', 'i', self.output_buffer + '[i]'))
+            source_file.write( '    }\n\n')
 
         elif version == 'v3':
-            if self.idx == 1: input_of_layer = 'nn_input'
-            else: input_of_layer = 'output_pre'
+            input_of_layer = self.input_buffer
+
+            weights = format_c_literals(self.layout_weights()).split(', ')
+            biases = format_c_literals(self.biases).split(', ')
 
             source_file.write(  '    // ' + self.name + '_' + str(self.idx) + '\n')
             for i in range(self.size):
                 source_file.write( '    dotproduct = 0;\n')
                 for j in range(self.previous_layer[0].size):
-                    source_file.write( '    dotproduct += ' +input_of_layer+ '['+str(j)+'] * '+ str(self.weights.flatten()[i+self.size*j]) +';\n')
-                source_file.write( '    dotproduct += '+ str(self.biases.flatten()[i]) +';\n')
+                    source_file.write( '    dotproduct += ' +input_of_layer+ '['+str(j)+'] * '+ weights[i*self.previous_layer[0].size+j] +';\n')
+                source_file.write( '    dotproduct += '+ biases[i] +';\n')
                 
                 a = self.activation_function.write_activation_str(self.local_var)
 
-                source_file.write( '    output_cur['+str(i)+'] = '+ a +';\n\n')
+                source_file.write( '    ' + self.output_buffer + '['+str(i)+'] = '+ a +';\n\n')
             
         else:
             pass  
 
+    def write_gemm_source(self, source_file, samples=None):
+        weights = 'weights_' + self.name + '_' + str("{:02d}".format(self.idx))
+        biases = 'biases_' + self.name + '_' + str("{:02d}".format(self.idx))
+        outputs = samples + '*' + str(self.size) if samples else str(self.size)
+
+        source_file.write(  '    // ' + self.name + '_' + str(self.idx) + '\n')
+        source_file.write( '    for (int i = 0; i < ' + outputs + '; ++i)\n')
+        source_file.write( '        ' + self.output_buffer + '[i] = ' + biases + '[i % ' + str(self.size) + '];\n')
+        if samples:
+            # The rows of the inputs of the block by the rows of the output-major weights
+            source_file.write( '    gemm_nt(' + samples + ', ' + str(self.size) + ', ' + str(self.previous_layer[0].size) + ', ' + self.input_buffer + ', ' + weights + ', ' + self.output_buffer + ');\n')
+        else:
+            # Product of the output-major weights by the input column
+            source_file.write( '    gemm(' + str(self.size) + ', 1, ' + str(self.previous_layer[0].size) + ', ' + weights + ', ' + self.input_buffer + ', ' + self.output_buffer + ');\n')
+        source_file.write( '    for (int i = 0; i < ' + outputs + '; ++i)\n')
+        source_file.write( '        ' + self.output_buffer + '[i] = ' + self.activation_function.write_activation_str(self.output_buffer + '[i]') + ';\n\n')
+
+    def write_batch_source(self, data_type, source_file, samples):
+        self.write_gemm_source(source_file, samples)
+
+    def write_vector_dotproducts(self, source_file):
+        # Each dot product is accumulated by vectors along the contiguous row of weights, then reduced
+        input_size = self.previous_layer[0].size
+        vector_end = input_size - input_size % self.simd
+        weights = 'weights_' + self.name + '_' + str("{:02d}".format(self.idx))
+
+        source_file.write(  '    // ' + self.name + '_' + str(self.idx) + '\n')
+        source_file.write(self.parallel_for('    ', self.local_var))
+        source_file.write( '    for (int i = 0; i < ' + str(self.size) + '; ++i) \n    { \n')
+        if vector_end > 0:
+            source_file.write( '        vec_t acc = {0};\n\n')
+            source_file.write( '        for (int j = 0; j < ' + str(vector_end) + '; j += ' + str(self.simd) + ')\n')
+            source_file.write( '            acc += *(vec_t *)&' + self.input_buffer + '[j] * *(vec_t *)&' + weights + '[i*' + str(input_size) + ' + j];\n')
+            source_file.write( '        dotproduct = ' + ' + '.join('acc[' + str(k) + ']' for k in range(self.simd)) + ';\n')
+        else:
+            source_file.write( '        dotproduct = 0;\n')
+        if vector_end < input_size:
+            source_file.write( '        for (int j = ' + str(vector_end) + '; j < ' + str(input_size) + '; ++j)\n')
+            source_file.write( '            dotproduct += ' + self.input_buffer + '[j] * ' + weights + '[i*' + str(input_size) + ' + j];\n')
+        source_file.write( '        dotproduct += biases_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[i];\n')
+        source_file.write( '        ' + self.output_buffer + '[i] = ' + self.activation_function.write_activation_str(self.local_var) + ';\n    }\n\n')
+
     def write_to_function_header_file(self, version, header_file):
         
         if version == 'v1' or version == 'v4':
@@ -335,7 +572,7 @@ class Dense(Layers):
         if version == 'v1' or version == 'v4':
 
             globalvars_file.write('    ['+str(self.idx)+'] = {\n' )
-            globalvars_file.write('        .layer_type = Dense,\n')
+            globalvars_file.write('        .layer_type = ' + self.kernel_name() + ',\n')
             globalvars_file.write('        .layer_size = l'+str(self.idx)+'_size,\n')
             globalvars_file.write('        .pad_right = 0x0,\n')
             globalvars_file.write('        .pad_left = 0x0,\n')
@@ -355,11 +592,24 @@ class Dense(Layers):
             globalvars_file.write('        .biases = biases_'+ self.name + '_' + str("{:02d}".format(self.idx)) + ',\n')
             globalvars_file.write('        .actv_function =  '+ (self.activation_function).name +',\n        },\n')
   
+    def quantize(self, output_range, preactivation_range=None):
+        self.quantize_weights(output_range, preactivation_range)
+
+    def preactivation(self, input):
+
+        # One row per sample, so that the whole batch is computed as a single matrix product
+        input = input.reshape(-1, (self.previous_layer[0]).size)
+
+        return np.dot(input, self.weights) + self.biases
+
     def feedforward(self, input):
 
-        input = input.reshape((self.previous_layer[0]).size) 
+        if self.output_scale is not None:
+            # int8 inference, computed as the generated code does with int32 accumulators
+            input = input.reshape(-1, (self.previous_layer[0]).size).astype(np.int64) - self.previous_layer[0].output_zero_point
+            return self.quantized_activation(np.dot(input, self.quantized_weights.astype(np.int64)) + self.quantized_biases)
 
-        return self.activation_function.compute((np.dot(input, self.weights) + self.biases))
+        return self.activation_function.compute(self.preactivation(input))
 
     def generate_flowfacts_dict(self, version):
         
@@ -440,17 +690,11 @@ def mma(
         B: np.array,
         C: np.array,
 ) -> np.array:
-    assert A.shape == (M, K)
-    assert B.shape == (K, N)
-    assert C.shape == (M, N)
-    D: np.array = np.zeros((M, N))
-    for m in range(M):
-        for n in range(N):
-            D[m, n] = 0.0
-            for k in range(K):
-                D[m, n] += A[m, k] * B[k, n]
-            D[m, n] += C[m, n]
-    return D
+    """Computes D = A * B + C on (stacks of) M x K, K x N and M x N fragments."""
+    assert A.shape[-2:] == (M, K)
+    assert B.shape[-2:] == (K, N)
+    assert C.shape[-2:] == (M, N)
+    return np.matmul(A, B) + C
 
 
 def input_index_of(
@@ -533,6 +777,125 @@ def conv2d_implicit(
                             output[oh, ow, g + m] += D[m, n]
 
 
+@lru_cache(maxsize=None)
+def conv2d_implicit_fragments(
+        FF: int,
+        CC: int,
+        OH: int,
+        OW: int,
+        KH: int,
+        KW: int,
+        IH: int,
+        IW: int,
+        strides: int,
+        dilation: int,
+        pad_left: int,
+        pad_top: int,
+        M: int,
+        N: int,
+        K: int,
+) -> tuple[np.array, np.array]:
+    """Returns the gather indices of the A (weights) and B (input) fragments used by conv2d_implicit.
+
+    A[g, k, :, :] is the M x K weights fragment for filters g*M... and kernel elements k*K...,
+    B[i, k, :, :] is the K x N input fragment for output elements i*N... and kernel elements k*K...
+    Indices of out-of-bounds or padded elements point past the end of the flattened array.
+    """
+    KL, OL = volume_of((KH, KW, CC)), volume_of((OH, OW))
+    G, T, KT = math.ceil(FF / M), math.ceil(OL / N), math.ceil(KL / K)
+    # A[g, kt, ah, aw] = weights[kh, kw, c, g*M + ah], with kh, kw, c = indices_of(kt*K + aw, (KH, KW, CC))
+    f = np.arange(G * M).reshape(G, 1, M, 1)
+    k = np.arange(KT * K).reshape(1, KT, 1, K)
+    a_indices = np.where((f < FF) & (k < KL), k * FF + f, KL * FF)
+    # B[t, kt, bh, bw] = input[ih, iw, c], with oh, ow = indices_of(t*N + bw, (OH, OW))
+    # and kh, kw, c = indices_of(kt*K + bh, (KH, KW, CC))
+    o = np.arange(T * N).reshape(T, 1, 1, N)
+    k = np.arange(KT * K).reshape(1, KT, K, 1)
+    ih = input_index_of(o // OW, k // (KW * CC), strides, dilation, pad_left)
+    iw = input_index_of(o % OW, k // CC % KW, strides, dilation, pad_top)
+    valid = (o < OL) & (k < KL) & (ih >= 0) & (ih < IH) & (iw >= 0) & (iw < IW)
+    b_indices = np.where(valid, (ih * IW + iw) * CC + k % CC, IH * IW * CC)
+    return a_indices, b_indices
+
+
+def conv2d_implicit_batched(
+        FF: int,
+        CC: int,
+        OH: int,
+        OW: int,
+        KH: int,
+        KW: int,
+        IH: int,
+        IW: int,
+        input,  # : f32[..., IH, IW, C],
+        weights,  # : f32[KH, KW, C, F],
+        biases,  # : f32[F],
+        strides,  # : int,
+        dilation,  # : int,
+        pad_left,  # : int,
+        pad_top,  # : int):
+        M: int = 8,
+        N: int = 8,
+        K: int = 4,
+):
+    """Emulates conv2d_implicit with all the fragments of a K step multiplied at once.
+
+    Each output element accumulates its bias then the K-fragment products in the same order as conv2d_implicit.
+    Padded input elements are read as zeros. Leading dimensions of input are treated as a batch.
+    """
+    a_indices, b_indices = conv2d_implicit_fragments(
+        FF, CC, OH, OW, KH, KW, IH, IW, strides, dilation, pad_left, pad_top, M, N, K
+    )
+    G, KT, _, _ = a_indices.shape
+    T = b_indices.shape[0]
+    batch = input.shape[:-3]
+    # Gather all the fragments, using the appended 0 for out-of-bounds elements
+    A = np.append(np.ravel(weights), 0.0)[a_indices]
+    flat_input = np.reshape(input, (*batch, IH * IW * CC))
+    flat_input = np.concatenate((flat_input, np.zeros((*batch, 1), dtype=flat_input.dtype)), axis=-1)
+    B = flat_input[..., b_indices]
+    # Accumulate output[..., g, t, m, n], starting from the biases
+    accumulator = np.zeros((*batch, G, T, M, N))
+    accumulator += np.append(biases, np.zeros(G * M - FF)).reshape(G, 1, M, 1)
+    for kt in range(KT):
+        # D[..., g, t] = A[g, kt] * B[..., t, kt] for all fragments at once
+        accumulator += mma(M, N, K, A[:, None, kt], B[..., None, :, kt, :, :], np.zeros((M, N)))
+    # Scatter back to output[..., oh, ow, f]
+    accumulator = np.moveaxis(accumulator, (-4, -3, -2, -1), (-2, -4, -1, -3))
+    accumulator = accumulator.reshape(*batch, T * N, G * M)[..., :OH * OW, :FF]
+    return accumulator.reshape(*batch, OH, OW, FF)
+
+
+def conv2d_sliding_window(
+        input,  # : f32[IH, IW, C],
+        weights,  # : f32[KH, KW, C, F],
+        biases,  # : f32[F],
+        strides: int,
+        dilation: int,
+        pad_left: int,
+        pad_top: int,
+        OH: int,
+        OW: int,
+):
+    """Computes a 2D convolution as a single contraction over strided views of the (padded) input.
+
+    The rows are padded by pad_left and the columns by pad_top, as in input_index_of and the generated kernels.
+    Leading dimensions of input are treated as a batch.
+    """
+    KH, KW, CC, FF = weights.shape
+    IH, IW = input.shape[-3:-1]
+    # Zeros after the input, up to the last element read by the last output row (column)
+    pad_bottom = max((OH - 1) * strides + (KH - 1) * dilation + 1 - pad_left - IH, 0)
+    pad_right = max((OW - 1) * strides + (KW - 1) * dilation + 1 - pad_top - IW, 0)
+    batch_padding = ((0, 0),) * (input.ndim - 3)
+    input = np.pad(input, (*batch_padding, (pad_left, pad_bottom), (pad_top, pad_right), (0, 0)))
+    # windows[..., oh, ow, c, m, n] = input[..., oh * strides + m * dilation, ow * strides + n * dilation, c]
+    windows = np.lib.stride_tricks.sliding_window_view(input, ((KH - 1) * dilation + 1, (KW - 1) * dilation + 1), axis=(-3, -2))
+    windows = windows[..., :(OH - 1) * strides + 1:strides, :(OW - 1) * strides + 1:strides, :, ::dilation, ::dilation]
+    # output[..., oh, ow, f] = sum(windows[..., oh, ow, c, m, n] * weights[m, n, c, f]) + biases[f]
+    return np.tensordot(windows, weights, axes=([-3, -2, -1], [2, 0, 1])) + biases
+
+
 def define_conv2D(strides: int, dilation: int, pad_left:int, pad_top: int):
     pass
     @proc
@@ -588,6 +951,11 @@ class Conv2D(Layers):
         self.biases = np.asarray(biases)
         self.activation_function = activation_function
         self.local_var = 'sum'
+        # Check the reference output against the tiled convolution emulation, using (M, N, K) fragments
+        self.cross_check = False
+        self.mma_fragment = (8, 8, 4)
+        # Number of filters computed together by the V2 kernel, on weights packed as [F/fb][KH][KW][C][fb]
+        self.filter_block = None
 
         self.nb_weights = self.count_elements_array(self.weights)
         self.nb_biases = self.count_elements_array(self.biases)
@@ -597,29 +965,278 @@ class Conv2D(Layers):
         else:
             self.pad_right, self.pad_left, self.pad_bottom, self.pad_top = 0, 0, 0, 0
 
+    def interior_region(self):
+        # Output rows [i_start, i_end) and columns [j_start, j_end) for which the whole kernel window
+        # lies in the input (the rows are padded by pad_left and the columns by pad_top, as in the kernels)
+        extent = (self.kernel_size - 1)*self.dilation_rate
+        i_start = min(-(-self.pad_left // self.strides), self.output_height)
+        i_end = min(max((self.input_height - 1 - extent + self.pad_left) // self.strides + 1, i_start), self.output_height)
+        j_start = min(-(-self.pad_top // self.strides), self.output_width)
+        j_end = min(max((self.input_width - 1 - extent + self.pad_top) // self.strides + 1, j_start), self.output_width)
+
+        return i_start, i_end, j_start, j_end
+
+    def layout_weights(self, weights=None):
+        weights = self.weights if weights is None else weights
+        if not self.filter_block:
+            return weights
+        # Blocks of filter_block filters, each stored as [KH][KW][C][fb] (the last block holds the remaining filters)
+        return np.concatenate([weights[..., f:f + self.filter_block].ravel() for f in range(0, self.nb_filters, self.filter_block)])
+
+    def write_loop_nest(self, data_type, source_file, i_range, j_range, bounds_check):
+        # Loop nest of the V2 convolution over a region of the output, with or without the input bounds check
+        if i_range[0] >= i_range[1] or j_range[0] >= j_range[1]:
+            return
+
+        if self.simd:
+            self.write_vector_loop_nest(data_type, source_file, i_range, j_range, bounds_check)
+            return
+        if self.filter_block:
+            self.write_blocked_loop_nest(data_type, source_file, i_range, j_range, bounds_check)
+            return
+
+        source_file.write(self.parallel_for('    ', self.local_var))
+        source_file.write('    for (int f = 0; f < ' + str(self.nb_filters) + '; ++f)\n    {\n')
+        source_file.write('        for (int i = '+str(i_range[0])+'; i < '+str(i_range[1])+'; ++i)\n        {\n')
+        source_file.write('            for (int j = '+str(j_range[0])+'; j < '+str(j_range[1])+'; ++j)\n            {\n')
+        source_file.write('                sum = 0;\n')
+        source_file.write('                for (int c = 0; c < '+str(self.input_channels)+'; ++c)\n                {\n')
+        source_file.write('                    for (int m = 0; m < '+str(self.kernel_size)+'; ++m)\n                    {\n')
+        source_file.write('                        for (int n = 0; n < '+str(self.kernel_size)+'; ++n)\n                        {\n')
+        source_file.write('                            int ii = i*'+str(self.strides)+' + m*'+str(self.dilation_rate)+' - '+str(self.pad_left)+';\n')
+        source_file.write('                            int jj = j*'+str(self.strides)+' + n*'+str(self.dilation_rate)+' - '+str(self.pad_top)+';\n\n')
+        if bounds_check:
+            source_file.write('                            if (ii >= 0 && ii < '+str(self.input_height)+' && jj >= 0 && jj < '+str(self.input_width)+')\n                            {\n')
+            source_file.write('                                sum += ' + self.input_buffer + '[(ii*'+str(self.input_width)+' + jj)*'+str(self.input_channels)+' + c] * weights_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[((m*'+str(self.kernel_size)+' + n)*'+str(self.input_channels)+' + c)*'+str(self.nb_filters)+' + f];\n'  )
+            source_file.write('                            }\n')
+        else:
+            source_file.write('                            sum += ' + self.input_buffer + '[(ii*'+str(self.input_width)+' + jj)*'+str(self.input_channels)+' + c] * weights_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[((m*'+str(self.kernel_size)+' + n)*'+str(self.input_channels)+' + c)*'+str(self.nb_filters)+' + f];\n'  )
+        source_file.write('                        }\n                    }\n                }\n')
+        source_file.write('                sum += biases_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[f];\n')
+
+        a = self.activation_function.write_activation_str(self.local_var)
+
+        source_file.write('                ' + self.output_buffer + '[(i*'+str(self.output_width)+' + j)*'+str(self.nb_filters)+' + f] = '+ a +';\n')
+        source_file.write('            }\n        }\n    }\n\n')
+
+    def write_quantized_loop_nest(self, data_type, source_file, i_range, j_range, bounds_check):
+        # Loop nest of the int8 convolution over a region of the output: the input is shifted by its zero point,
+        # so that the padded elements (real 0) are simply skipped
+        if i_range[0] >= i_range[1] or j_range[0] >= j_range[1]:
+            return
+
+        input_zero_point = self.previous_layer[0].output_zero_point
+
+        source_file.write(self.parallel_for('    ', 'acc'))
+        source_file.write('    for (int f = 0; f < ' + str(self.nb_filters) + '; ++f)\n    {\n')
+        source_file.write('        for (int i = '+str(i_range[0])+'; i < '+str(i_range[1])+'; ++i)\n        {\n')
+        source_file.write('            for (int j = '+str(j_range[0])+'; j < '+str(j_range[1])+'; ++j)\n            {\n')
+        source_file.write('                acc = biases_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[f];\n')
+        source_file.write('                for (int c = 0; c < '+str(self.input_channels)+'; ++c)\n                {\n')
+        source_file.write('                    for (int m = 0; m < '+str(self.kernel_size)+'; ++m)\n                    {\n')
+        source_file.write('                        for (int n = 0; n < '+str(self.kernel_size)+'; ++n)\n                        {\n')
+        source_file.write('                            int ii = i*'+str(self.strides)+' + m*'+str(self.dilation_rate)+' - '+str(self.pad_left)+';\n')
+        source_file.write('                            int jj = j*'+str(self.strides)+' + n*'+str(self.dilation_rate)+' - '+str(self.pad_top)+';\n\n')
+        product = 'acc += (' + self.input_buffer + '[(ii*'+str(self.input_width)+' + jj)*'+str(self.input_channels)+' + c] - (' + str(input_zero_point) + ')) * weights_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[((m*'+str(self.kernel_size)+' + n)*'+str(self.input_channels)+' + c)*'+str(self.nb_filters)+' + f];\n'
+        if bounds_check:
+            source_file.write('                            if (ii >= 0 && ii < '+str(self.input_height)+' && jj >= 0 && jj < '+str(self.input_width)+')\n')
+            source_file.write('                                ' + product)
+        else:
+            source_file.write('                            ' + product)
+        source_file.write('                        }\n                    }\n                }\n')
+        source_file.write(self.write_requantization('                ', 'f', self.output_buffer + '[(i*'+str(self.output_width)+' + j)*'+str(self.nb_filters)+' + f]'))
+        source_file.write('            }\n        }\n    }\n\n')
+
+    def im2col_size(self):
+        # A pointwise convolution without stride nor padding reads its input directly as the im2col matrix
+        if self.kernel_size == 1 and self.strides == 1 and self.pad_left == 0 and self.pad_top == 0:
+            return 0
+        return self.output_height*self.output_width*self.kernel_size*self.kernel_size*self.input_channels
+
+    def write_gemm_source(self, data_type, source_file, samples=None):
+        # The output (rows: output pixels, columns: filters) is the product of the im2col matrix by the weights,
+        # the pixels of the samples of a block follow each other
+        pixels = str(self.output_height*self.output_width)
+        if samples:
+            pixels = samples + '*' + pixels
+
+        source_file.write('    // ' + self.name + '_' + str(self.idx) + '\n')
+        if self.scratch_size > 0:
+            columns = 'l' + str(self.idx) + '_scratch'
+            self.write_im2col(data_type, source_file, columns, samples)
+        else:
+            columns = self.input_buffer
+
+        source_file.write('    for (int p = 0; p < ' + pixels + '; ++p)\n    {\n')
+        source_file.write('        for (int f = 0; f < ' + str(self.nb_filters) + '; ++f)\n')
+        source_file.write('            ' + self.output_buffer + '[p*' + str(self.nb_filters) + ' + f] = biases_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[f];\n    }\n')
+        source_file.write('    gemm(' + pixels + ', ' + str(self.nb_filters) + ', ' + str(self.kernel_size*self.kernel_size*self.input_channels) + ', ' + columns + ', weights_' + self.name + '_' + str("{:02d}".format(self.idx)) + ', ' + self.output_buffer + ');\n')
+        source_file.write('    for (int k = 0; k < ' + pixels + '*' + str(self.nb_filters) + '; ++k)\n')
+        source_file.write('        ' + self.output_buffer + '[k] = ' + self.activation_function.write_activation_str(self.output_buffer + '[k]') + ';\n\n')
+
+    def write_batch_source(self, data_type, source_file, samples):
+        self.write_gemm_source(data_type, source_file, samples)
+
+    def write_im2col(self, data_type, source_file, columns, samples=None):
+        # One row per output pixel, holding its [KH][KW][C] input window (zeros in the padding). For a block,
+        # the rows r of the output of all the samples are enumerated, i being the row within the sample.
+        source_file.write(self.parallel_for('    '))
+        if samples:
+            row = 'r'
+            input_buffer = 'sample_input'
+            source_file.write('    for (int r = 0; r < '+samples+'*'+str(self.output_height)+'; ++r)\n    {\n')
+            source_file.write('        int i = r % '+str(self.output_height)+';\n')
+            source_file.write('        ' + data_type + ' *sample_input = ' + self.input_buffer + ' + r/'+str(self.output_height)+'*'+str(self.input_height*self.input_width*self.input_channels)+';\n\n')
+        else:
+            row = 'i'
+            input_buffer = self.input_buffer
+            source_file.write('    for (int i = 0; i < '+str(self.output_height)+'; ++i)\n    {\n')
+        source_file.write('        for (int j = 0; j < '+str(self.output_width)+'; ++j)\n        {\n')
+        source_file.write('            for (int m = 0; m < '+str(self.kernel_size)+'; ++m)\n            {\n')
+        source_file.write('                for (int n = 0; n < '+str(self.kernel_size)+'; ++n)\n                {\n')
+        source_file.write('                    int ii = i*'+str(self.strides)+' + m*'+str(self.dilation_rate)+' - '+str(self.pad_left)+';\n')
+        source_file.write('                    int jj = j*'+str(self.strides)+' + n*'+str(self.dilation_rate)+' - '+str(self.pad_top)+';\n')
+        source_file.write('                    ' + data_type + ' *col = ' + columns + ' + ((('+row+'*'+str(self.output_width)+' + j)*'+str(self.kernel_size)+' + m)*'+str(self.kernel_size)+' + n)*'+str(self.input_channels)+';\n\n')
+        source_file.write('                    if (ii >= 0 && ii < '+str(self.input_height)+' && jj >= 0 && jj < '+str(self.input_width)+')\n                    {\n')
+        source_file.write('                        for (int c = 0; c < '+str(self.input_channels)+'; ++c)\n')
+        source_file.write('                            col[c] = ' + input_buffer + '[(ii*'+str(self.input_width)+' + jj)*'+str(self.input_channels)+' + c];\n')
+        source_file.write('                    }\n                    else\n                    {\n')
+        source_file.write('                        for (int c = 0; c < '+str(self.input_channels)+'; ++c)\n')
+        source_file.write('                            col[c] = 0;\n')
+        source_file.write('                    }\n                }\n            }\n        }\n    }\n')
+
+    def write_vector_loop_nest(self, data_type, source_file, i_range, j_range, bounds_check):
+        # Each output pixel is computed by vectors of consecutive filters, the input element being broadcast
+        # to the vector of weights, the remaining filters are computed one by one
+        vector_end = self.nb_filters - self.nb_filters % self.simd
+        weights = 'weights_' + self.name + '_' + str("{:02d}".format(self.idx))
+        biases = 'biases_' + self.name + '_' + str("{:02d}".format(self.idx))
+        output = self.output_buffer + '[(i*'+str(self.output_width)+' + j)*'+str(self.nb_filters)+' + f'
+
+        source_file.write(self.parallel_for('    ', self.local_var))
+        source_file.write('    for (int i = '+str(i_range[0])+'; i < '+str(i_range[1])+'; ++i)\n    {\n')
+        source_file.write('        for (int j = '+str(j_range[0])+'; j < '+str(j_range[1])+'; ++j)\n        {\n')
+        for f_range, vector in (((0, vector_end), True), ((vector_end, self.nb_filters), False)):
+            if f_range[0] >= f_range[1]:
+                continue
+            step = ' f += ' + str(self.simd) if vector else ' ++f'
+            source_file.write('            for (int f = '+str(f_range[0])+'; f < '+str(f_range[1])+';' + step + ')\n            {\n')
+            source_file.write('                vec_t acc = {0};\n' if vector else '                sum = 0;\n')
+            source_file.write('                for (int m = 0; m < '+str(self.kernel_size)+'; ++m)\n                {\n')
+            source_file.write('                    for (int n = 0; n < '+str(self.kernel_size)+'; ++n)\n                    {\n')
+            source_file.write('                        int ii = i*'+str(self.strides)+' + m*'+str(self.dilation_rate)+' - '+str(self.pad_left)+';\n')
+            source_file.write('                        int jj = j*'+str(self.strides)+' + n*'+str(self.dilation_rate)+' - '+str(self.pad_top)+';\n\n')
+            inner = '                        '
+            if bounds_check:
+                source_file.write(inner + 'if (ii >= 0 && ii < '+str(self.input_height)+' && jj >= 0 && jj < '+str(self.input_width)+')\n' + inner + '{\n')
+                inner += '    '
+            source_file.write(inner + 'for (int c = 0; c < '+str(self.input_channels)+'; ++c)\n')
+            x = self.input_buffer + '[(ii*'+str(self.input_width)+' + jj)*'+str(self.input_channels)+' + c]'
+            w = weights + '[((m*'+str(self.kernel_size)+' + n)*'+str(self.input_channels)+' + c)*'+str(self.nb_filters)+' + f]'
+            if vector:
+                source_file.write(inner + '    acc += ' + x + ' * *(vec_t *)&' + w + ';\n')
+            else:
+                source_file.write(inner + '    sum += ' + x + ' * ' + w + ';\n')
+            if bounds_check:
+                source_file.write('                        }\n')
+            source_file.write('                    }\n                }\n')
+            if vector:
+                source_file.write('                acc += *(vec_t *)&' + biases + '[f];\n')
+                source_file.write('                for (int k = 0; k < ' + str(self.simd) + '; ++k)\n')
+                source_file.write('                    ' + output + ' + k] = ' + self.activation_function.write_activation_str('acc[k]') + ';\n')
+            else:
+                source_file.write('                sum += ' + biases + '[f];\n')
+                source_file.write('                ' + output + '] = ' + self.activation_function.write_activation_str(self.local_var) + ';\n')
+            source_file.write('            }\n')
+        source_file.write('        }\n    }\n\n')
+
+    def write_blocked_loop_nest(self, data_type, source_file, i_range, j_range, bounds_check):
+        # Each output pixel is computed by blocks of filters, the accumulators of a block stay in registers
+        # while the input window is read once per block
+        full_blocks, last_block = divmod(self.nb_filters, self.filter_block)
+        block_weights = self.kernel_size*self.kernel_size*self.input_channels
+
+        source_file.write(self.parallel_for('    '))
+        source_file.write('    for (int i = '+str(i_range[0])+'; i < '+str(i_range[1])+'; ++i)\n    {\n')
+        source_file.write('        for (int j = '+str(j_range[0])+'; j < '+str(j_range[1])+'; ++j)\n        {\n')
+        if full_blocks > 0:
+            source_file.write('            for (int fb = 0; fb < '+str(full_blocks)+'; ++fb)\n            {\n')
+            self.write_filter_block(data_type, source_file, 'fb*'+str(self.filter_block), 'fb*'+str(block_weights*self.filter_block), self.filter_block, bounds_check, '                ')
+            source_file.write('            }\n')
+        if last_block > 0:
+            source_file.write('            {\n')
+            self.write_filter_block(data_type, source_file, str(full_blocks*self.filter_block), str(full_blocks*block_weights*self.filter_block), last_block, bounds_check, '                ')
+            source_file.write('            }\n')
+        source_file.write('        }\n    }\n\n')
+
+    def write_filter_block(self, data_type, source_file, first_filter, first_weight, block_size, bounds_check, indent):
+        weights = 'weights_' + self.name + '_' + str("{:02d}".format(self.idx))
+        biases = 'biases_' + self.name + '_' + str("{:02d}".format(self.idx))
+
+        for k in range(block_size):
+            source_file.write(indent + data_type + ' sum_'+str(k)+' = 0;\n')
+        source_file.write(indent + 'for (int m = 0; m < '+str(self.kernel_size)+'; ++m)\n' + indent + '{\n')
+        source_file.write(indent + '    for (int n = 0; n < '+str(self.kernel_size)+'; ++n)\n' + indent + '    {\n')
+        source_file.write(indent + '        int ii = i*'+str(self.strides)+' + m*'+str(self.dilation_rate)+' - '+str(self.pad_left)+';\n')
+        source_file.write(indent + '        int jj = j*'+str(self.strides)+' + n*'+str(self.dilation_rate)+' - '+str(self.pad_top)+';\n\n')
+        inner = indent + '        '
+        if bounds_check:
+            source_file.write(inner + 'if (ii >= 0 && ii < '+str(self.input_height)+' && jj >= 0 && jj < '+str(self.input_width)+')\n' + inner + '{\n')
+            inner += '    '
+        source_file.write(inner + 'for (int c = 0; c < '+str(self.input_channels)+'; ++c)\n' + inner + '{\n')
+        source_file.write(inner + '    ' + data_type + ' x = ' + self.input_buffer + '[(ii*'+str(self.input_width)+' + jj)*'+str(self.input_channels)+' + c];\n')
+        source_file.write(inner + '    ' + data_type + ' *w = ' + weights + ' + ' + first_weight + ' + ((m*'+str(self.kernel_size)+' + n)*'+str(self.input_channels)+' + c)*'+str(block_size)+';\n\n')
+        for k in range(block_size):
+            source_file.write(inner + '    sum_'+str(k)+' += x * w['+str(k)+'];\n')
+        source_file.write(inner + '}\n')
+        if bounds_check:
+            source_file.write(indent + '        }\n')
+        source_file.write(indent + '    }\n' + indent + '}\n')
+
+        for k in range(block_size):
+            source_file.write(indent + 'sum_'+str(k)+' += ' + biases + '[' + first_filter + ' + '+str(k)+'];\n')
+            a = self.activation_function.write_activation_str('sum_'+str(k))
+            source_file.write(indent + self.output_buffer + '[(i*'+str(self.output_width)+' + j)*'+str(self.nb_filters)+' + ' + first_filter + ' + '+str(k)+'] = '+ a +';\n')
+
     def write_to_layer_c_files(self, data_type, version, layers_source_file, layers_header_file):
 
         if version == 'v1':
             
-            layers_source_file.write('int Conv2D(int layer_idx, ' + data_type + ' *input, '+ data_type + ' *output) \n{ \n')
+            layers_source_file.write('int ' + self.kernel_name() + '(int layer_idx, ' + data_type + ' *input, '+ data_type + ' *output) \n{ \n')
             layers_source_file.write('    '+ data_type + ' sum;\n\n')
+            layers_source_file.write('    /* Output region where the kernel window lies in the input, the bounds check is only needed outside of it */\n')
+            layers_source_file.write('    int extent = (net[layer_idx].kernel_size - 1)*net[layer_idx].dilation_rate;\n')
+            layers_source_file.write('    int i_start = (net[layer_idx].pad_left + net[layer_idx].strides - 1)/net[layer_idx].strides;\n')
+            layers_source_file.write('    int i_end = net[layer_idx].input_height - extent + net[layer_idx].pad_left > 0 ? (net[layer_idx].input_height - 1 - extent + net[layer_idx].pad_left)/net[layer_idx].strides + 1 : 0;\n')
+            layers_source_file.write('    int j_start = (net[layer_idx].pad_top + net[layer_idx].strides - 1)/net[layer_idx].strides;\n')
+            layers_source_file.write('    int j_end = net[layer_idx].input_width - extent + net[layer_idx].pad_top > 0 ? (net[layer_idx].input_width - 1 - extent + net[layer_idx].pad_top)/net[layer_idx].strides + 1 : 0;\n\n')
+            layers_source_file.write(self.parallel_for('    ', self.local_var))
             layers_source_file.write('    for (int f = 0; f < net[layer_idx].nb_filters; ++f)\n    {\n')
             layers_source_file.write('        for (int i = 0; i < net[layer_idx].output_height; ++i)\n        {\n')
             layers_source_file.write('            for (int j = 0; j < net[layer_idx].output_width; ++j)\n            {\n')
             layers_source_file.write('                sum = 0;\n')
-            layers_source_file.write('                for (int c = 0; c < net[layer_idx].input_channels; ++c)\n                {\n')
-            layers_source_file.write('                    for (int m = 0; m < net[layer_idx].kernel_size; ++m)\n                    {\n')
-            layers_source_file.write('                        for (int n = 0; n < net[layer_idx].kernel_size; ++n)\n                        {\n')
-            layers_source_file.write('                            int ii = i*net[layer_idx].strides + m*net[layer_idx].dilation_rate - net[layer_idx].pad_left;\n')
-            layers_source_file.write('                            int jj = j*net[layer_idx].strides + n*net[layer_idx].dilation_rate - net[layer_idx].pad_top;\n\n')
-            layers_source_file.write('                            if (ii >= 0 && ii < net[layer_idx].input_height && jj >= 0 && jj < net[layer_idx].input_width)\n                            {\n')
+            layers_source_file.write('                if (i >= i_start && i < i_end && j >= j_start && j < j_end)\n                {\n')
+            layers_source_file.write('                    for (int c = 0; c < net[layer_idx].input_channels; ++c)\n                    {\n')
+            layers_source_file.write('                        for (int m = 0; m < net[layer_idx].kernel_size; ++m)\n                        {\n')
+            layers_source_file.write('                            for (int n = 0; n < net[layer_idx].kernel_size; ++n)\n                            {\n')
+            layers_source_file.write('                                int ii = i*net[layer_idx].strides + m*net[layer_idx].dilation_rate - net[layer_idx].pad_left;\n')
+            layers_source_file.write('                                int jj = j*net[layer_idx].strides + n*net[layer_idx].dilation_rate - net[layer_idx].pad_top;\n\n')
             layers_source_file.write('                                sum += input[(ii*net[layer_idx].input_width + jj)*net[layer_idx].input_channels + c] * net[layer_idx].weights[((m*net[layer_idx].kernel_size + n)*net[layer_idx].input_channels + c)*net[layer_idx].nb_filters + f];\n'  )
             layers_source_file.write('                            }\n                        }\n                    }\n                }\n')
+            layers_source_file.write('                else\n                {\n')
+            layers_source_file.write('                    for (int c = 0; c < net[layer_idx].input_channels; ++c)\n                    {\n')
+            layers_source_file.write('                        for (int m = 0; m < net[layer_idx].kernel_size; ++m)\n                        {\n')
+            layers_source_file.write('                            for (int n = 0; n < net[layer_idx].kernel_size; ++n)\n                            {\n')
+            layers_source_file.write('                                int ii = i*net[layer_idx].strides + m*net[layer_idx].dilation_rate - net[layer_idx].pad_left;\n')
+            layers_source_file.write('                                int jj = j*net[layer_idx].strides + n*net[layer_idx].dilation_rate - net[layer_idx].pad_top;\n\n')
+            layers_source_file.write('                                if (ii >= 0 && ii < net[layer_idx].input_height && jj >= 0 && jj < net[layer_idx].input_width)\n                                {\n')
+            layers_source_file.write('                                    sum += input[(ii*net[layer_idx].input_width + jj)*net[layer_idx].input_channels + c] * net[layer_idx].weights[((m*net[layer_idx].kernel_size + n)*net[layer_idx].input_channels + c)*net[layer_idx].nb_filters + f];\n'  )
+            layers_source_file.write('                                }\n                            }\n                        }\n                    }\n                }\n')
             layers_source_file.write('                sum += net[layer_idx].biases[f];\n'            )
-            layers_source_file.write('                output[(i*net[layer_idx].output_width + j)*net[layer_idx].nb_filters + f] = net[layer_idx].actv_function(sum);\n')
+            layers_source_file.write('                output[(i*net[layer_idx].output_width + j)*net[layer_idx].nb_filters + f] = ' + self.activation_function.write_activation_call('sum') + ';\n')
             layers_source_file.write('            }\n        }\n    }\n\n    return 0;\n}\n\n')
 
-            layers_header_file.write('int Conv2D(int layer_idx, ' + data_type + ' *input, '+ data_type + ' *output);\n')
+            layers_header_file.write('int ' + self.kernel_name() + '(int layer_idx, ' + data_type + ' *input, '+ data_type + ' *output);\n')
         elif version == 'v4':
             conv = define_conv2D(self.strides, self.dilation_rate, self.pad_left, self.pad_top)
             # Can derive a specific version using conv = conv.partial_eval(...)
@@ -631,7 +1248,7 @@ class Conv2D(Layers):
             # This should be used, be the layers needs to know the ouput directory: conv.compile_c(None, conv.name())
             layers_source_file.write(conv.c_code_str())
             layers_source_file.write(f"""
-            int Conv2D(int layer_idx, {data_type}  *input, {data_type} *output) 
+            int {self.kernel_name()}(int layer_idx, {data_type}  *input, {data_type} *output) 
             {{
                 {conv.name()}(
                     NULL, // ctxt c_code_str_Context*
@@ -655,7 +1272,7 @@ class Conv2D(Layers):
                     {{
                         for (int j = 0; j < net[layer_idx].output_width; ++j)
                         {{
-                            output[(i*net[layer_idx].output_width + j)*net[layer_idx].nb_filters + f] = net[layer_idx].actv_function(output[(i*net[layer_idx].output_width + j)*net[layer_idx].nb_filters + f]);
+                            output[(i*net[layer_idx].output_width + j)*net[layer_idx].nb_filters + f] = {self.activation_function.write_activation_call('output[(i*net[layer_idx].output_width + j)*net[layer_idx].nb_filters + f]')};
                         }}
                     }}
                 }}
@@ -665,37 +1282,34 @@ class Conv2D(Layers):
             
             """)
 
-            layers_header_file.write('int Conv2D(int layer_idx, ' + data_type + ' *input, ' + data_type + ' *output);\n')
+            layers_header_file.write('int ' + self.kernel_name() + '(int layer_idx, ' + data_type + ' *input, ' + data_type + ' *output);\n')
 
     def write_to_function_source_file(self, data_type, version, source_file):
          
-        if version == 'v2':
+        if version == 'v2' or version == 'v9':
             source_file.write('    // ' + self.name + '_' + str(self.idx) + '\n')
-            source_file.write('    for (int f = 0; f < ' + str(self.nb_filters) + '; ++f)\n    {\n')
-            source_file.write('        for (int i = 0; i < '+str(self.output_height)+'; ++i)\n        {\n')
-            source_file.write('            for (int j = 0; j < '+str(self.output_width)+'; ++j)\n            {\n')
-            source_file.write('                sum = 0;\n')
-            source_file.write('                for (int c = 0; c < '+str(self.input_channels)+'; ++c)\n                {\n')
-            source_file.write('                    for (int m = 0; m < '+str(self.kernel_size)+'; ++m)\n                    {\n')
-            source_file.write('                        for (int n = 0; n < '+str(self.kernel_size)+'; ++n)\n                        {\n')
-            source_file.write('                            int ii = i*'+str(self.strides)+' + m*'+str(self.dilation_rate)+' - '+str(self.pad_left)+';\n')
-            source_file.write('                            int jj = j*'+str(self.strides)+' + n*'+str(self.dilation_rate)+' - '+str(self.pad_top)+';\n\n')
-            source_file.write('                            if (ii >= 0 && ii < '+str(self.input_height)+' && jj >= 0 && jj < '+str(self.input_width)+')\n                            {\n')
+            write_loop_nest = self.write_quantized_loop_nest if version == 'v9' else self.write_loop_nest
+
+            # The bounds check is only needed on the padded border of the output
+            i_start, i_end, j_start, j_end = self.interior_region()
+            if i_start < i_end and j_start < j_end:
+                write_loop_nest(data_type, source_file, (i_start, i_end), (j_start, j_end), False)
+                write_loop_nest(data_type, source_file, (0, i_start), (0, self.output_width), True)
+                write_loop_nest(data_type, source_file, (i_end, self.output_height), (0, self.output_width), True)
+                write_loop_nest(data_type, source_file, (i_start, i_end), (0, j_start), True)
+                write_loop_nest(data_type, source_file, (i_start, i_end), (j_end, self.output_width), True)
+            else:
+                write_loop_nest(data_type, source_file, (0, self.output_height), (0, self.output_width), True)
+
+        elif version == 'v8':
+            self.write_gemm_source(data_type, source_file)
 
-            source_file.write('                                sum += output_pre[(ii*'+str(self.input_width)+' + jj)*'+str(self.input_channels)+' + c] * weights_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[((m*'+str(self.kernel_size)+' + n)*'+str(self.input_channels)+' + c)*'+str(self.nb_filters)+' + f];\n'  )
-         
-            source_file.write('                            }\n                        }\n                    }\n                }\n')
-            source_file.write('                sum += biases_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[f];\n'            )
-            
-            a = self.activation_function.write_activation_str(self.local_var)
-                       
-            source_file.write('                output_cur[(i*'+str(self.output_width)+' + j)*'+str(self.nb_filters)+' + f] = '+ a +';\n')
-            source_file.write('            }\n        }\n    }\n\n')
-            
         elif version == 'v3':
             
-            if self.idx == 1: input_of_layer = 'nn_input'
-            else: input_of_layer = 'output_pre'
+            input_of_layer = self.input_buffer
+
+            weights = format_c_literals(self.weights).split(', ')
+            biases = format_c_literals(self.biases).split(', ')
 
             source_file.write('    // ' + self.name + '_' + str(self.idx) + '\n')
             for f in range(self.nb_filters):
@@ -710,16 +1324,16 @@ class Conv2D(Layers):
                                     jj = j*self.strides + n*self.dilation_rate - self.pad_top                                
                                     if ii >= 0 and ii <self.input_height and jj >= 0 and jj < self.input_width :
                                         
-                                        s += '    sum += ' + input_of_layer + '['+str((ii*self.input_width + jj)*self.input_channels+c)+'] * '+ str((self.weights.flatten())[((m*self.kernel_size + n)*self.input_channels+c)*self.nb_filters + f]) +';\n'
+                                        s += '    sum += ' + input_of_layer + '['+str((ii*self.input_width + jj)*self.input_channels+c)+'] * '+ weights[((m*self.kernel_size + n)*self.input_channels+c)*self.nb_filters + f] +';\n'
 
                                     else:
                                         continue
 
                         source_file.write(s)
-                        source_file.write('    sum += '+ str((self.biases.flatten())[f]) +';\n'            )
+                        source_file.write('    sum += '+ biases[f] +';\n')
                         a = self.activation_function.write_activation_str(self.local_var)
 
-                        source_file.write('    output_cur['+str((i*self.output_width+ j)*self.nb_filters+ f)+'] = '+ a +';\n\n')
+                        source_file.write('    ' + self.output_buffer + '['+str((i*self.output_width+ j)*self.nb_filters+ f)+'] = '+ a +';\n\n')
 
         else:
             pass    
@@ -750,7 +1364,7 @@ class Conv2D(Layers):
         
         if version == 'v1' or version == 'v4':
             globalvars_file.write('    ['+str(self.idx)+'] = {\n' )
-            globalvars_file.write('        .layer_type = Conv2D,\n')
+            globalvars_file.write('        .layer_type = ' + self.kernel_name() + ',\n')
             globalvars_file.write('        .layer_size = l'+str(self.idx)+'_size,\n'   )
             globalvars_file.write('        .pad_right = l'+str(self.idx)+'_pad_right,\n')
             globalvars_file.write('        .pad_left = l'+str(self.idx)+'_pad_left,\n')
@@ -770,62 +1384,72 @@ class Conv2D(Layers):
             globalvars_file.write('        .biases = biases_'+ self.name + '_' + str("{:02d}".format(self.idx)) + ',\n')
             globalvars_file.write('        .actv_function =  '+ (self.activation_function).name +',\n        },\n')
     
-    def feedforward(self, input):
-
-        input = input.reshape(self.input_height, self.input_width, self.input_channels)
-        output = np.zeros((self.output_height, self.output_width, self.nb_filters))
+    def quantize(self, output_range, preactivation_range=None):
+        self.quantize_weights(output_range, preactivation_range)
 
-        if self.pad_right and self.pad_left and self.pad_top and self.pad_bottom:
-            input_padded = np.zeros((self.input_height + self.pad_top + self.pad_bottom, self.input_width + self.pad_left + self.pad_right, self.input_channels))
-            input_padded[self.pad_top:-self.pad_bottom, self.pad_left:-self.pad_right, :] = input
-        else:
-            input_padded = input
+    def feedforward(self, input):
 
-        implicit_input = np.copy(input)
-        implicit_output = np.copy(output)
-        conv2d_implicit(
-            self.nb_filters,
-            self.input_channels,
-            self.output_height,
-            self.output_width,
-            self.kernel_size,
-            self.kernel_size,
-            self.input_height,
-            self.input_width,
-            implicit_input,
-            implicit_output,
+        if self.output_scale is not None:
+            # int8 inference, computed as the generated code does with int32 accumulators on the input shifted
+            # by its zero point (the padding being 0)
+            input = input.reshape(-1, self.input_height, self.input_width, self.input_channels).astype(np.int64) - self.previous_layer[0].output_zero_point
+            accumulators = conv2d_sliding_window(
+                input,
+                self.quantized_weights.astype(np.int64),
+                self.quantized_biases.astype(np.int64),
+                self.strides,
+                self.dilation_rate,
+                self.pad_left,
+                self.pad_top,
+                self.output_height,
+                self.output_width,
+            )
+            return self.quantized_activation(accumulators)
+
+        return self.activation_function.compute(self.preactivation(input))
+
+    def preactivation(self, input):
+
+        input = input.reshape(-1, self.input_height, self.input_width, self.input_channels)
+
+        output = conv2d_sliding_window(
+            input,
             self.weights,
             self.biases,
             self.strides,
             self.dilation_rate,
             self.pad_left,
             self.pad_top,
+            self.output_height,
+            self.output_width,
         )
 
-        # x = define_conv2D(self.strides, self.dilation_rate, self.pad_left, self.pad_top)
-        # x.interpret(
-        #     F=self.nb_filters,
-        #     C=self.input_channels,
-        #     OH=self.output_height,
-        #     OW=self.output_width,
-        #     KH=self.kernel_size,
-        #     KW=self.kernel_size,
-        #     IH=self.input_height,
-        #     IW=self.output_width,
-        #     input=implicit_input,
-        #     output=implicit_output,
-        #     weights=self.weights,
-        #     biases=self.biases,
-        # )
-
-        for f in range(self.nb_filters):
-            for j in range(self.output_width): 
-                for i in range(self.output_height):
-                    output[i,j,f]=np.sum(input_padded[i*self.strides:i*self.strides+self.kernel_size, j*self.strides:j*self.strides+self.kernel_size, :] * self.weights[:,:,:,f]) + self.biases[f]
-                    assert math.isclose(output[i, j, f], implicit_output[i, j, f], rel_tol=0.01), \
-                        f"[{i}, {j}, {f}](shape: {output.shape}):  {output[i, j, f]} == {implicit_output[i, j, f]}"
+        if self.cross_check:
+            # Element-wise check against the emulation of the tiled convolution
+            implicit_output = conv2d_implicit_batched(
+                self.nb_filters,
+                self.input_channels,
+                self.output_height,
+                self.output_width,
+                self.kernel_size,
+                self.kernel_size,
+                self.input_height,
+                self.input_width,
+                input,
+                self.weights,
+                self.biases,
+                self.strides,
+                self.dilation_rate,
+                self.pad_left,
+                self.pad_top,
+                *self.mma_fragment,
+            )
+            mismatches = np.argwhere(~np.isclose(output, implicit_output, rtol=0.01, atol=0.0))
+            if len(mismatches) > 0:
+                first = ', '.join(f"{list(index)}: {output[tuple(index)]} != {implicit_output[tuple(index)]}" for index in mismatches[:5])
+                raise AssertionError(f"{len(mismatches)} outputs of {self.name}_{self.idx} (shape: {output.shape}) differ from the tiled convolution, first ones {first}")
 
-        return self.activation_function.compute(output)
+        return output
 
     def generate_flowfacts_dict(self, version):
         
@@ -869,7 +1493,6 @@ class Pooling2D(Layers):
         self.input_channels = input_shape[3]
         self.output_height = output_shape[1]
         self.output_width = output_shape[2]
-        self.pooling_funtion = ''
         self.local_var = ''
         self.local_var_2 = ''
         self.output_var = ''
@@ -887,6 +1510,7 @@ class Pooling2D(Layers):
 
             layers_source_file.write(self.declare_local_vars(data_type))
             
+            layers_source_file.write(self.parallel_for('    ', *self.local_vars()))
             layers_source_file.write('    for (int c = 0; c < net[layer_idx].input_channels; ++c)\n    {\n')
             layers_source_file.write('        for (int i = 0; i < net[layer_idx].output_height; ++i)\n        {\n')
             layers_source_file.write('            for (int j = 0; j < net[layer_idx].output_width; ++j)\n            {\n')
@@ -917,28 +1541,34 @@ class Pooling2D(Layers):
 
     def write_to_function_source_file(self, data_type, version, source_file):
  
-        if version == 'v2':
+        if version == 'v2' and self.simd:
+            # Vectors of consecutive channels, the remaining channels are pooled one by one
+            vector_end = self.input_channels - self.input_channels % self.simd
             source_file.write('    // ' + self.name + '_' + str(self.idx) + '\n')
-            source_file.write('    for (int c = 0; c < '+str(self.input_channels)+'; ++c)\n    {\n')
-            source_file.write('        for (int i = 0; i < '+str(self.output_height)+'; ++i)\n        {\n')
-            source_file.write('            for (int j = 0; j < '+str(self.output_width)+'; ++j)\n            {\n')
-
-            source_file.write('            ' + self.update_local_vars())
-
-            source_file.write('                for (int m = 0; m < '+str(self.pool_size)+'; ++m)\n                {\n')
-            source_file.write('                    for (int n = 0; n < '+str(self.pool_size)+'; ++n)\n                    {\n')
-            source_file.write('                        int ii = i*'+str(self.strides)+' + m - '+str(self.pad_left)+';\n')
-            source_file.write('                        int jj = j*'+str(self.strides)+' + n - '+str(self.pad_top)+';\n\n')
-            source_file.write('                        if (ii >= 0 && ii < '+str( self.input_height)+' && jj >= 0 && jj < '+str(self.input_width)+')\n                        {\n')
+            if vector_end > 0:
+                source_file.write(self.parallel_for('    ', *self.local_vars()))
+                source_file.write('    for (int i = 0; i < '+str(self.output_height)+'; ++i)\n    {\n')
+                source_file.write('        for (int j = 0; j < '+str(self.output_width)+'; ++j)\n        {\n')
+                source_file.write('            for (int c = 0; c < '+str(vector_end)+'; c += '+str(self.simd)+')\n            {\n')
+                source_file.write('            ' + self.update_vector_local_vars())
+                source_file.write('                for (int m = 0; m < '+str(self.pool_size)+'; ++m)\n                {\n')
+                source_file.write('                    for (int n = 0; n < '+str(self.pool_size)+'; ++n)\n                    {\n')
+                source_file.write('                        int ii = i*'+str(self.strides)+' + m - '+str(self.pad_left)+';\n')
+                source_file.write('                        int jj = j*'+str(self.strides)+' + n - '+str(self.pad_top)+';\n\n')
+                source_file.write('                        if (ii >= 0 && ii < '+str( self.input_height)+' && jj >= 0 && jj < '+str(self.input_width)+')\n                        {\n')
+                source_file.write(self.specific_vector_function('(ii*'+str(self.input_width)+' + jj)*'+str(self.input_channels)+' + c', self.input_buffer))
+                source_file.write('                        }\n                    }\n                }\n')
+                source_file.write('            ' + self.generate_vector_output_str(data_type, '(i*'+str(self.output_width)+' + j)*'+str(self.input_channels)+' + c', self.output_buffer))
+                source_file.write('            }\n        }\n    }\n\n')
+            if vector_end < self.input_channels:
+                self.write_channel_loop_nest(version, source_file, vector_end)
+
+        elif version == 'v2' or version == 'v8' or version == 'v9':
+            source_file.write('    // ' + self.name + '_' + str(self.idx) + '\n')
+            self.write_channel_loop_nest(version, source_file, 0)
 
-            source_file.write(self.specific_function(version, '(ii*'+str(self.input_width)+' + jj)*'+str(self.input_channels)+' + c', 'output_pre'))
-            source_file.write('                        }\n                    }\n                }\n')
-            source_file.write('            ' + self.generate_output_str('(i*'+str(self.output_width)+' + j)*'+str(self.input_channels)+' + c', 'output_cur'))
-            source_file.write('            }\n        }\n    }\n\n')
-      
-        elif version == 'v3':    
-            if self.idx == 1: input_of_layer = 'nn_input'
-            else: input_of_layer = 'output_pre'
+        elif version == 'v3':
+            input_of_layer = self.input_buffer
 
             source_file.write('    // ' + self.name + '_' + str(self.idx) + '\n')
             for c in range(self.input_channels):
@@ -959,11 +1589,39 @@ class Pooling2D(Layers):
                                 else:
                                     continue
 
-                        source_file.write(self.generate_output_str(str((i*self.output_width+ j)*self.input_channels+ c), 'output_cur') + '\n')
+                        source_file.write(self.generate_output_str(str((i*self.output_width+ j)*self.input_channels+ c), self.output_buffer) + '\n')
 
         else:
             pass    
 
+    def write_channel_loop_nest(self, version, source_file, c_start):
+        source_file.write(self.parallel_for('    ', *self.local_vars()))
+        source_file.write('    for (int c = '+str(c_start)+'; c < '+str(self.input_channels)+'; ++c)\n    {\n')
+        source_file.write('        for (int i = 0; i < '+str(self.output_height)+'; ++i)\n        {\n')
+        source_file.write('            for (int j = 0; j < '+str(self.output_width)+'; ++j)\n            {\n')
+
+        source_file.write('            ' + (self.update_quantized_local_vars() if version == 'v9' else self.update_local_vars()))
+
+        source_file.write('                for (int m = 0; m < '+str(self.pool_size)+'; ++m)\n                {\n')
+        source_file.write('                    for (int n = 0; n < '+str(self.pool_size)+'; ++n)\n                    {\n')
+        source_file.write('                        int ii = i*'+str(self.strides)+' + m - '+str(self.pad_left)+';\n')
+        source_file.write('                        int jj = j*'+str(self.strides)+' + n - '+str(self.pad_top)+';\n\n')
+        source_file.write('                        if (ii >= 0 && ii < '+str( self.input_height)+' && jj >= 0 && jj < '+str(self.input_width)+')\n                        {\n')
+
+        source_file.write(self.specific_function(version, '(ii*'+str(self.input_width)+' + jj)*'+str(self.input_channels)+' + c', self.input_buffer))
+        source_file.write('                        }\n                    }\n                }\n')
+        output_str = self.generate_quantized_output_str if version == 'v9' else self.generate_output_str
+        source_file.write('            ' + output_str('(i*'+str(self.output_width)+' + j)*'+str(self.input_channels)+' + c', self.output_buffer))
+        source_file.write('            }\n        }\n    }\n\n')
+
+    def update_quantized_local_vars(self):
+        # Initialization of the local variables of the int8 kernel
+        return self.update_local_vars()
+
+    def generate_quantized_output_str(self, index, output):
+        # int8 output of the int8 kernel, in the scale and zero point of the input
+        return self.generate_output_str(index, output)
+
     def write_to_function_header_file(self, version, header_file):
         
         if version == 'v1' or version == 'v4':
@@ -1006,22 +1664,32 @@ class Pooling2D(Layers):
             globalvars_file.write('        .biases = 0x0,\n')
             globalvars_file.write('        .actv_function = 0x0,\n        },\n')
 
+    def pooling_windows(self, input, pad_value):
+        # Strided view windows[n, i, j, c, m, n] = input[n, i*strides + m - pad_left, j*strides + n - pad_top, c],
+        # the rows being padded by pad_left and the columns by pad_top as in the kernels
+        pad_bottom = max((self.output_height - 1)*self.strides + self.pool_size - self.pad_left - self.input_height, 0)
+        pad_right = max((self.output_width - 1)*self.strides + self.pool_size - self.pad_top - self.input_width, 0)
+        input = np.pad(input, ((0, 0), (self.pad_left, pad_bottom), (self.pad_top, pad_right), (0, 0)), constant_values=pad_value)
+        windows = np.lib.stride_tricks.sliding_window_view(input, (self.pool_size, self.pool_size), axis=(1, 2))
+
+        return windows[:, ::self.strides, ::self.strides][:, :self.output_height, :self.output_width]
+
+    @abstractmethod
+    def pooling_function(self, input):
+        pass
+
+    @abstractmethod
+    def quantized_pooling_function(self, input):
+        pass
+
     def feedforward(self, input):
 
-        input = input.reshape(self.input_height, self.input_width, self.input_channels)
-        output = np.zeros((self.output_height, self.output_width, self.input_channels))
-        
-        if self.pad_right and self.pad_left and self.pad_top and self.pad_bottom:
-            input_padded = np.zeros((self.input_height + self.pad_top + self.pad_bottom, self.input_width + self.pad_left + self.pad_right, self.input_channels))
-            input_padded[self.pad_top:-self.pad_bottom, self.pad_left:-self.pad_right, :] = input
-        else:
-            input_padded = input
+        input = input.reshape(-1, self.input_height, self.input_width, self.input_channels)
 
-        for c in range(self.input_channels):
-            for j in range(self.output_width): 
-                for i in range(self.output_height):
-                    output[i,j,c]= self.pooling_function((input_padded[i*self.strides:i*self.strides+self.pool_size, j*self.strides:j*self.strides+self.pool_size, c]))
-        return output
+        if self.output_scale is not None:
+            return self.quantized_pooling_function(input)
+
+        return self.pooling_function(input)
 
     def generate_flowfacts_dict(self, version):
         
@@ -1052,11 +1720,28 @@ class AveragePooling2D(Pooling2D):
         super().__init__(**kwds)
         
         self.name = 'AveragePooling2D'
-        self.pooling_function = np.mean
         self.local_var = 'sum'
         self.local_var_2 = 'count'
         self.output_var = self.local_var + '/' + self.local_var_2
 
+    def pooling_function(self, input):
+        # Padded elements are not part of the average, as in the generated code
+        sums = self.pooling_windows(input, 0).sum(axis=(-2, -1))
+        counts = self.pooling_windows(np.ones((1, *input.shape[1:3], 1)), 0).sum(axis=(-2, -1))
+
+        return sums / counts
+
+    def quantized_pooling_function(self, input):
+        # Rounded average of the int8 values, shifted by 128 so that the integer division rounds as on positive values
+        sums = self.pooling_windows(input.astype(np.int64), 0).sum(axis=(-2, -1))
+        counts = self.pooling_windows(np.ones((1, *input.shape[1:3], 1), dtype=np.int64), 0).sum(axis=(-2, -1))
+
+        return ((sums + 128*counts + counts//2)//counts - 128).astype(np.int8)
+
+    def generate_quantized_output_str(self, index, output):
+
+        return '    '+output+'['+index+'] = ('+self.local_var+' + 128*'+self.local_var_2+' + '+self.local_var_2+'/2)/'+self.local_var_2+' - 128;\n\n'
+
     def declare_local_vars(self, data_type):
         
         s = '    '+ data_type + ' '+ self.local_var +';\n'
@@ -1070,6 +1755,26 @@ class AveragePooling2D(Pooling2D):
   
         return s
 
+    def local_vars(self):
+        return [self.local_var, self.local_var_2]
+
+    def update_vector_local_vars(self):
+
+        s = '    vec_t '+ self.local_var + '_v = {0}; '+ self.local_var_2 + ' = 0;\n'
+
+        return s
+
+    def specific_vector_function(self, index, input_of_layer):
+
+        s = '                            '+self.local_var+'_v += *(vec_t *)&'+input_of_layer+'['+index+'];\n'
+        s += '                            '+self.local_var_2+' ++;\n'
+
+        return s
+
+    def generate_vector_output_str(self, data_type, index, output):
+
+        return '    *(vec_t *)&'+output+'['+index+'] = '+self.local_var+'_v / ('+data_type+')'+self.local_var_2+';\n'
+
     def specific_function(self, version, index, input_of_layer):
         # Computes the average in this subclass AveragePooling2D 
 
@@ -1090,10 +1795,21 @@ class MaxPooling2D(Pooling2D):
         super().__init__(**kwds)
         
         self.name = 'MaxPooling2D'
-        self.pooling_function = np.amax
         self.local_var = 'max'
         self.output_var = self.local_var
 
+    def pooling_function(self, input):
+
+        return self.pooling_windows(input, -np.inf).max(axis=(-2, -1))
+
+    def quantized_pooling_function(self, input):
+
+        return self.pooling_windows(input, -128).max(axis=(-2, -1))
+
+    def update_quantized_local_vars(self):
+
+        return '    '+ self.local_var +' = -128;\n'
+
     def declare_local_vars(self, data_type):
         
         s = '    '+ data_type + ' '+ self.local_var +';\n\n'
@@ -1106,6 +1822,23 @@ class MaxPooling2D(Pooling2D):
 
         return s
 
+    def local_vars(self):
+        return [self.local_var]
+
+    def update_vector_local_vars(self):
+
+        s = '    vec_t '+ self.local_var +'_v = {' + ', '.join(['-INFINITY']*self.simd) + '};\n'
+
+        return s
+
+    def specific_vector_function(self, index, input_of_layer):
+
+        return '                            '+self.local_var+'_v = vec_max('+self.local_var+'_v, *(vec_t *)&'+input_of_layer+'['+index+']);\n'
+
+    def generate_vector_output_str(self, data_type, index, output):
+
+        return '    *(vec_t *)&'+output+'['+index+'] = '+self.local_var+'_v;\n'
+
     def specific_function(self, version, index, input_of_layer):
         
         if version == 'v3':       
@@ -1118,6 +1851,97 @@ class MaxPooling2D(Pooling2D):
     
         return s
 
+class Conv2DPooling2D(Layers):
+    # Conv2D followed by the pooling layer reading its output, computed by a single kernel: each output of the
+    # convolution is reduced into its pooling window as soon as it is computed, so that it is never stored
+    def __init__(self, conv, pooling):
+
+        super().__init__()
+        self.idx = conv.idx
+        self.size = pooling.size
+        self.name = conv.name
+        self.conv = conv
+        self.pooling = pooling
+
+        # The weights keep the names of the convolution in the generated code
+        self.weights = conv.weights
+        self.biases = conv.biases
+        self.nb_weights = conv.nb_weights
+        self.nb_biases = conv.nb_biases
+        self.activation_function = conv.activation_function
+        self.openmp = conv.openmp
+
+        self.previous_layer = conv.previous_layer
+        self.next_layer = pooling.next_layer
+        for layer in self.previous_layer:
+            layer.next_layer[layer.next_layer.index(conv)] = self
+        for layer in self.next_layer:
+            layer.previous_layer[layer.previous_layer.index(pooling)] = self
+
+    def layout_weights(self, weights=None):
+        return self.conv.layout_weights(weights)
+
+    def write_to_layer_c_files(self, data_type, version, layers_source_file, layers_header_file):
+        pass
+
+    def write_to_function_source_file(self, data_type, version, source_file):
+
+        if version == 'v2' or version == 'v8':
+            conv, pooling = self.conv, self.pooling
+            average = isinstance(pooling, AveragePooling2D)
+            # The bounds check of the convolution is only needed if some kernel windows overlap its padding
+            bounds_check = conv.interior_region() != (0, conv.output_height, 0, conv.output_width)
+
+            source_file.write('    // ' + conv.name + '_' + str(conv.idx) + ' + ' + pooling.name + '_' + str(pooling.idx) + '\n')
+            source_file.write(self.parallel_for('    ', *(['sum', 'count'] if average else ['sum'])))
+            source_file.write('    for (int f = 0; f < ' + str(conv.nb_filters) + '; ++f)\n    {\n')
+            source_file.write('        for (int i = 0; i < ' + str(pooling.output_height) + '; ++i)\n        {\n')
+            source_file.write('            for (int j = 0; j < ' + str(pooling.output_width) + '; ++j)\n            {\n')
+            if average:
+                source_file.write('                ' + data_type + ' pooled = 0; count = 0;\n')
+            else:
+                source_file.write('                ' + data_type + ' pooled = -INFINITY;\n')
+            source_file.write('                for (int pm = 0; pm < ' + str(pooling.pool_size) + '; ++pm)\n                {\n')
+            source_file.write('                    for (int pn = 0; pn < ' + str(pooling.pool_size) + '; ++pn)\n                    {\n')
+            source_file.write('                        int ci = i*' + str(pooling.strides) + ' + pm - ' + str(pooling.pad_left) + ';\n')
+            source_file.write('                        int cj = j*' + str(pooling.strides) + ' + pn - ' + str(pooling.pad_top) + ';\n\n')
+            source_file.write('                        if (ci >= 0 && ci < ' + str(conv.output_height) + ' && cj >= 0 && cj < ' + str(conv.output_width) + ')\n                        {\n')
+
+            # Output (ci, cj, f) of the convolution
+            source_file.write('                            sum = 0;\n')
+            source_file.write('                            for (int c = 0; c < ' + str(conv.input_channels) + '; ++c)\n                            {\n')
+            source_file.write('                                for (int m = 0; m < ' + str(conv.kernel_size) + '; ++m)\n                                {\n')
+            source_file.write('                                    for (int n = 0; n < ' + str(conv.kernel_size) + '; ++n)\n                                    {\n')
+            source_file.write('                                        int ii = ci*' + str(conv.strides) + ' + m*' + str(conv.dilation_rate) + ' - ' + str(conv.pad_left) + ';\n')
+            source_file.write('                                        int jj = cj*' + str(conv.strides) + ' + n*' + str(conv.dilation_rate) + ' - ' + str(conv.pad_top) + ';\n\n')
+            product = 'sum += ' + self.input_buffer + '[(ii*' + str(conv.input_width) + ' + jj)*' + str(conv.input_channels) + ' + c] * weights_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[((m*' + str(conv.kernel_size) + ' + n)*' + str(conv.input_channels) + ' + c)*' + str(conv.nb_filters) + ' + f];\n'
+            if bounds_check:
+                source_file.write('                                        if (ii >= 0 && ii < ' + str(conv.input_height) + ' && jj >= 0 && jj < ' + str(conv.input_width) + ')\n')
+                source_file.write('                                            ' + product)
+            else:
+                source_file.write('                                        ' + product)
+            source_file.write('                                    }\n                                }\n                            }\n')
+            source_file.write('                            sum += biases_' + self.name + '_' + str("{:02d}".format(self.idx)) + '[f];\n')
+            source_file.write('                            sum = ' + self.activation_function.write_activation_str('sum') + ';\n\n')
+
+            # Reduction into the pooling window
+            if average:
+                source_file.write('                            pooled += sum;\n')
+                source_file.write('                            count ++;\n')
+            else:
+                source_file.write('                            if (sum > pooled)\n')
+                source_file.write('                                pooled = sum;\n')
+            source_file.write('                        }\n                    }\n                }\n')
+            source_file.write('                ' + self.output_buffer + '[(i*' + str(pooling.output_width) + ' + j)*' + str(conv.nb_filters) + ' + f] = ' + ('pooled/count' if average else 'pooled') + ';\n')
+            source_file.write('            }\n        }\n    }\n\n')
+
+        else:
+            pass
+
+    def feedforward(self, input):
+
+        return self.pooling.feedforward(self.conv.feedforward(input))
+
 class Softmax(Layers):
 
     def __init__(self, idx, size):
@@ -1132,39 +1956,73 @@ class Softmax(Layers):
         if version == 'v1' or version == 'v4':
 
             layers_source_file.write('int Softmax(int layer_idx, ' + data_type + ' *input, '+ data_type + ' *output) \n{ \n')
+            layers_source_file.write('    '+ data_type + ' max = input[0];\n')
             layers_source_file.write('    '+ data_type + ' sum = 0;\n\n')
-            layers_source_file.write('    for (int i = 0; i < net[layer_idx].layer_size; ++i) \n')
-            layers_source_file.write('        sum += exp(input[i]);\n\n')
+            layers_source_file.write('    for (int i = 1; i < net[layer_idx].layer_size; ++i) \n')
+            layers_source_file.write('        if (input[i] > max)\n')
+            layers_source_file.write('            max = input[i];\n\n')
+            layers_source_file.write('    for (int i = 0; i < net[layer_idx].layer_size; ++i) \n    {\n')
+            layers_source_file.write('        output[i] = exp(input[i] - max);\n')
+            layers_source_file.write('        sum += output[i];\n    }\n\n')
             layers_source_file.write('    for (int j = 0; j < net[layer_idx].layer_size; ++j)\n')
-            layers_source_file.write('        output[j] = exp(input[j])/sum;\n\n')
+            layers_source_file.write('        output[j] = output[j]/sum;\n\n')
             layers_source_file.write('    return 0; \n} \n\n')
             
             layers_header_file.write('int Softmax(int layer_idx, ' + data_type + ' *input, '+ data_type + ' *output);\n')
 
     def write_to_function_source_file(self, data_type, version, source_file):
         
-        if version == 'v2':    
+        if version == 'v2' or version == 'v8':    
             source_file.write('    // ' + self.name + '_' + str(self.idx) + '\n')
-            source_file.write('    sum = 0;\n\n')
+            source_file.write('    max = ' + self.input_buffer + '[0];\n')
+            source_file.write('    for (int i = 1; i < ' + str(self.size) + '; ++i)\n')
+            source_file.write('        if (' + self.input_buffer + '[i] > max)\n')
+            source_file.write('            max = ' + self.input_buffer + '[i];\n\n')
+            self.write_normalization(source_file, self.size, self.input_buffer, self.output_buffer)
+
+        elif version == 'v9':
+            # Exponentials in Q16 read from the table by the difference to the maximum, the output
+            # is rounded to the scale 1/256 (zero point -128)
+            table = 'table_' + self.name + '_' + str("{:02d}".format(self.idx))
+            source_file.write('    // ' + self.name + '_' + str(self.idx) + '\n')
+            source_file.write('    max = ' + self.input_buffer + '[0];\n')
+            source_file.write('    for (int i = 1; i < ' + str(self.size) + '; ++i)\n')
+            source_file.write('        if (' + self.input_buffer + '[i] > max)\n')
+            source_file.write('            max = ' + self.input_buffer + '[i];\n\n')
+            source_file.write('    sum = 0;\n')
             source_file.write('    for (int i = 0; i < ' + str(self.size) + '; ++i)\n')
-            source_file.write('        sum += exp(output_pre[i]);\n\n')
+            source_file.write('        sum += ' + table + '[' + self.input_buffer + '[i] - max + 255];\n')
             source_file.write('    for (int j = 0; j < ' + str(self.size) + '; ++j)\n')
-            source_file.write('        output_cur[j] = exp(output_pre[j])/sum;\n\n')
-
+            source_file.write('        ' + self.output_buffer + '[j] = saturate((' + table + '[' + self.input_buffer + '[j] - max + 255]*256 + sum/2)/sum - 128);\n\n')
 
         elif version == 'v3':       
             
             source_file.write('    // ' + self.name + '_' + str(self.idx) + '\n')
+            source_file.write('    max = ' + self.input_buffer + '[0];\n')
+            for i in range(1, self.size):
+                source_file.write('    if (' + self.input_buffer + '['+ str(i) +'] > max) max = ' + self.input_buffer + '['+ str(i) +'];\n')
             source_file.write('    sum = 0;\n')
             for i in range(self.size):
-                source_file.write('    sum += exp(output_pre['+ str(i) +']);\n')
+                source_file.write('    ' + self.output_buffer + '['+str(i)+'] = exp(' + self.input_buffer + '['+ str(i) +'] - max);\n')
+                source_file.write('    sum += ' + self.output_buffer + '['+str(i)+'];\n')
             for j in range(self.size):
-                source_file.write('    output_cur['+str(j)+'] = exp(output_pre['+str(j)+'])/sum;\n')
+                source_file.write('    ' + self.output_buffer + '['+str(j)+'] = ' + self.output_buffer + '['+str(j)+']/sum;\n')
             source_file.write('\n')
 
         else:
             pass 
 
+    @staticmethod
+    def write_normalization(source_file, size, input_buffer, output_buffer):
+        # Exponentials of the inputs shifted by their maximum (already in max), which cannot overflow, then
+        # divided by their sum. The input may be the output buffer itself.
+        source_file.write('    sum = 0;\n')
+        source_file.write('    for (int i = 0; i < ' + str(size) + '; ++i)\n    {\n')
+        source_file.write('        ' + output_buffer + '[i] = exp(' + input_buffer + '[i] - max);\n')
+        source_file.write('        sum += ' + output_buffer + '[i];\n    }\n')
+        source_file.write('    for (int j = 0; j < ' + str(size) + '; ++j)\n')
+        source_file.write('        ' + output_buffer + '[j] = ' + output_buffer + '[j]/sum;\n\n')
+
     def write_to_function_header_file(self, version, header_file):
         
         if version == 'v1' or version == 'v4':
@@ -1201,10 +2059,26 @@ class Softmax(Layers):
 
         return
 
+    def quantize(self, output_range, preactivation_range=None):
+        # exp(input_scale*d) in Q16 for the differences d in [-255, 0] of the int8 inputs to their maximum
+        input_scale = self.previous_layer[0].output_scale
+        self.output_scale, self.output_zero_point = 1/256, -128
+        self.exp_table = np.round(65536*np.exp(input_scale*np.arange(-255, 1))).astype(np.int32)
+
+    def quantized_parameters(self):
+        return [('int32_t', 'table_' + self.name + '_' + str("{:02d}".format(self.idx)), self.exp_table)]
+
     def feedforward(self, input):
-        
-        exp = np.exp(input, dtype=float)
-        output = exp/np.sum(exp)
+
+        if self.output_scale is not None:
+            input = input.reshape(-1, self.size).astype(np.int64)
+            exp = self.exp_table[input - np.max(input, axis=-1, keepdims=True) + 255].astype(np.int64)
+            sum = np.sum(exp, axis=-1, keepdims=True)
+            return np.clip((exp*256 + sum//2)//sum - 128, -128, 127).astype(np.int8)
+
+        # Shifted by the maximum as in the generated code, in the data type of the model (that of the input)
+        exp = np.exp(input - np.max(input, axis=-1, keepdims=True))
+        output = exp/np.sum(exp, axis=-1, keepdims=True)
 
         return output
     
@@ -1226,3 +2100,77 @@ class Softmax(Layers):
             self.list_of_dicts = [first_loop, second_loop]
 
             return Layers.generate_flowfacts_dict(self)
+
+
+class DenseSoftmax(Layers):
+    # Dense layer followed by the Softmax of its outputs, computed by a single kernel: the maximum of the outputs
+    # is tracked while the dot products are computed, then the outputs are normalized in place
+    def __init__(self, dense, softmax):
+
+        super().__init__()
+        self.idx = dense.idx
+        self.size = dense.size
+        self.name = dense.name
+        self.dense = dense
+        self.softmax = softmax
+
+        # The weights keep the names of the Dense layer in the generated code
+        self.weights = dense.weights
+        self.biases = dense.biases
+        self.nb_weights = dense.nb_weights
+        self.nb_biases = dense.nb_biases
+        self.activation_function = dense.activation_function
+        self.local_var = dense.local_var
+        self.openmp = dense.openmp
+
+        self.previous_layer = dense.previous_layer
+        self.next_layer = softmax.next_layer
+        for layer in self.previous_layer:
+            layer.next_layer[layer.next_layer.index(dense)] = self
+        for layer in self.next_layer:
+            layer.previous_layer[layer.previous_layer.index(softmax)] = self
+
+    def layout_weights(self, weights=None):
+        return self.dense.layout_weights(weights)
+
+    def write_to_layer_c_files(self, data_type, version, layers_source_file, layers_header_file):
+        pass
+
+    def write_to_function_source_file(self, data_type, version, source_file):
+
+        weights = 'weights_' + self.name + '_' + str("{:02d}".format(self.idx))
+        biases = 'biases_' + self.name + '_' + str("{:02d}".format(self.idx))
+        input_size = self.previous_layer[0].size
+
+        if version == 'v2':
+            source_file.write('    // ' + self.dense.name + '_' + str(self.dense.idx) + ' + ' + self.softmax.name + '_' + str(self.softmax.idx) + '\n')
+            source_file.write('    max = -INFINITY;\n')
+            source_file.write(self.parallel_for('    ', self.local_var, reduction='max:max'))
+            source_file.write('    for (int i = 0; i < ' + str(self.size) + '; ++i)\n    {\n')
+            source_file.write('        dotproduct = 0;\n')
+            source_file.write('        for (int j = 0; j < ' + str(input_size) + '; ++j)\n')
+            source_file.write('            dotproduct += ' + self.input_buffer + '[j] * ' + weights + '[(' + str(input_size) + '*i + j)];\n')
+            source_file.write('        dotproduct += ' + biases + '[i];\n')
+            source_file.write('        ' + self.output_buffer + '[i] = ' + self.activation_function.write_activation_str(self.local_var) + ';\n')
+            source_file.write('        if (' + self.output_buffer + '[i] > max)\n')
+            source_file.write('            max = ' + self.output_buffer + '[i];\n    }\n')
+            Softmax.write_normalization(source_file, self.size, self.output_buffer, self.output_buffer)
+
+        elif version == 'v8':
+            source_file.write('    // ' + self.dense.name + '_' + str(self.dense.idx) + ' + ' + self.softmax.name + '_' + str(self.softmax.idx) + '\n')
+            source_file.write('    for (int i = 0; i < ' + str(self.size) + '; ++i)\n')
+            source_file.write('        ' + self.output_buffer + '[i] = ' + biases + '[i];\n')
+            source_file.write('    gemm(' + str(self.size) + ', 1, ' + str(input_size) + ', ' + weights + ', ' + self.input_buffer + ', ' + self.output_buffer + ');\n')
+            source_file.write('    max = -INFINITY;\n')
+            source_file.write('    for (int i = 0; i < ' + str(self.size) + '; ++i)\n    {\n')
+            source_file.write('        ' + self.output_buffer + '[i] = ' + self.activation_function.write_activation_str(self.output_buffer + '[i]') + ';\n')
+            source_file.write('        if (' + self.output_buffer + '[i] > max)\n')
+            source_file.write('            max = ' + self.output_buffer + '[i];\n    }\n')
+            Softmax.write_normalization(source_file, self.size, self.output_buffer, self.output_buffer)
+
+        else:
+            pass
+
+    def feedforward(self, input):
+
+        return self.softmax.feedforward(self.dense.feedforward(input))
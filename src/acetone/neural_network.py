@@ -20,39 +20,98 @@
 
 import os
 import json
+import multiprocessing
 import numpy as np
 from pathlib import Path
 from itertools import islice
 from pystache import Renderer, TemplateSpec
 from .activation_functions import Linear, ReLu, Sigmoid, TanH, ActivationFunctions
-from .layers import AveragePooling2D, MaxPooling2D, InputLayer, Dense, Conv2D, Softmax
+from .layers import Pooling2D, AveragePooling2D, MaxPooling2D, InputLayer, Dense, Conv2D, Conv2DPooling2D, Softmax, DenseSoftmax, format_c_literals
 from abc import ABC, abstractmethod
 
 import acetone.templates
 from .templates import *
 
 
+# Layers evaluated by the reference inference worker processes, set once per worker by init_inference_worker
+worker_layers = None
+
+
+def init_inference_worker(layers):
+    global worker_layers
+    worker_layers = layers
+
+
+def feedforward_layers(nn_inputs, layers = None):
+    previous_layer_result = nn_inputs  # for the very first layer, it is the neural network input
+
+    for layer in (worker_layers if layers is None else layers):
+        current_layer_result = layer.feedforward(previous_layer_result)
+        previous_layer_result = current_layer_result
+
+    return np.reshape(current_layer_result, (len(current_layer_result), -1))
+
+
 class CodeGenerator(ABC):
+    buffer_alignment = None
+    # Number of samples computed together by the generated inference_batch, None if it is not generated
+    batch_block = None
+    # Options of the kernels implemented by some generators only: each generator consumes the ones it implements,
+    # the others reach this class and are rejected, instead of silently generating the code without them
+    kernel_options = ('filter_block', 'simd', 'batch_block', 'fuse_pooling', 'fuse_softmax')
+
 
-    def __init__(self, json_file, test_dataset_file = None, function_name = 'inference', nb_tests = None, **kwds):
+    def __init__(self, json_file, test_dataset_file = None, function_name = 'inference', nb_tests = None, cross_check = False, binary_dataset = False, openmp = False, activation_impl = 'libm', **kwds):
+
+        self.reject_options(**{option: value for option, value in kwds.items() if option in self.kernel_options})
 
         self.json_file = json_file
         self.test_dataset_file = test_dataset_file
         self.function_name = function_name
         self.nb_tests = nb_tests
+        # Read the test inputs from a binary file at runtime, instead of compiling them in the harness
+        self.binary_dataset = binary_dataset
+        # Implementation of the activation functions, either one for all of them (libm, approx or lut) or
+        # a comma separated list of activation=implementation, e.g. tanh=lut,sigmoid=approx
+        self.activation_impl = activation_impl
+        self.activation_implementations = self.parse_activation_impl(activation_impl)
 
         l, dtype, dtype_py = self.load_json()
         self.layers = l
         self.data_type = dtype
         self.data_type_py = dtype_py
 
+        # The approximated activations are checked against the exact functions over their whole domain
+        checked = {}
+        for layer in self.layers:
+            if hasattr(layer, 'activation_function') and layer.activation_function.implementation != 'libm':
+                checked[layer.activation_function.name] = layer.activation_function
+        for name, activation_function in checked.items():
+            print(f"{name} ({activation_function.implementation}): maximum error {activation_function.max_error(self.data_type):.3g} against libm.")
+
+        # Multi-threaded kernels, the number of threads is set at runtime by OMP_NUM_THREADS
+        self.openmp = openmp
+
+        for layer in self.layers:
+            if isinstance(layer, Conv2D):
+                layer.cross_check = cross_check
+            layer.openmp = openmp
+
         ds = self.load_test_dataset()
         self.test_dataset = ds
 
+        self.plan_activations_memory()
+
+    def reject_options(self, **options):
+
+        for option, value in options.items():
+            if value:
+                raise ValueError("The --" + option.replace('_', '-') + " option is not implemented by " + type(self).__name__ + ".")
+
     def load_json(self):
 
-        file = open(self.json_file, 'r')
-        model = json.load(file)
+        with open(self.json_file, 'r') as file:
+            model = json.load(file)
 
         data_type = model['config']['layers'][0]['config']['dtype']
 
@@ -92,10 +151,10 @@ class CodeGenerator(ABC):
                 pass
 
             if layer['class_name'] == 'Dense':
-                current_layer = Dense(idx, layer['config']['units'], data_type_py(layer['weights']), data_type_py(layer['biases']), self.create_actv_function_obj(layer['config']['activation']))
+                current_layer = Dense(idx, layer['config']['units'], self.load_parameters(layer['weights'], data_type_py), self.load_parameters(layer['biases'], data_type_py), self.create_actv_function_obj(layer['config']['activation']))
 
             elif layer['class_name'] == 'Conv2D':
-                current_layer = Conv2D(idx, layer['config']['size'], layer['config']['padding'], layer['config']['strides'][0], layer['config']['kernel_size'][0], layer['config']['dilation_rate'][0], layer['config']['filters'], layer['config']['input_shape'], layer['config']['output_shape'], data_type_py(layer['weights']), data_type_py(layer['biases']), self.create_actv_function_obj(layer['config']['activation']))
+                current_layer = Conv2D(idx, layer['config']['size'], layer['config']['padding'], layer['config']['strides'][0], layer['config']['kernel_size'][0], layer['config']['dilation_rate'][0], layer['config']['filters'], layer['config']['input_shape'], layer['config']['output_shape'], self.load_parameters(layer['weights'], data_type_py), self.load_parameters(layer['biases'], data_type_py), self.create_actv_function_obj(layer['config']['activation']))
 
             elif layer['class_name'] == 'AveragePooling2D':
                 current_layer = AveragePooling2D(idx = idx, size = layer['config']['size'], padding = layer['config']['padding'], strides = layer['config']['strides'][0], pool_size = layer['config']['pool_size'][0], input_shape = layer['config']['input_shape'], output_shape = layer['config']['output_shape'])
@@ -124,92 +183,167 @@ class CodeGenerator(ABC):
         print("Finished model initialization.")
         return layers, data_type, data_type_py
 
-    def load_test_dataset(self):
+    def load_parameters(self, parameters, data_type_py):
+
+        # Parameters are either inlined in the model as nested lists, or stored in a .npy/.npz sidecar file
+        # referenced as {"file": path relative to the model, "key": array name for .npz archives}.
+        if not isinstance(parameters, dict):
+            return data_type_py(parameters)
+
+        sidecar_file = Path(self.json_file).parent / parameters['file']
+
+        if sidecar_file.suffix == '.npz':
+            with np.load(sidecar_file) as archive:
+                array = archive[parameters['key']]
+        else:
+            # .npy sidecars are memory-mapped, pages are only read when the generator accesses the values
+            array = np.load(sidecar_file, mmap_mode='r')
+
+        # Only copies the array if the sidecar type differs from the model type
+        return np.asarray(array, dtype=data_type_py)
+
+    def load_test_dataset(self, chunk_size = 1024):
 
-        test_dataset = []
-        try:
-            with open(self.test_dataset_file, 'r') as f:
-                for i, line in enumerate(f):
-                    line = line[1:-2].split(',')
-                    if self.data_type == 'int':
-                        line = list(map(int,line))
-                    elif self.data_type == 'double':
-                        line = list(map(float,line))
-                    elif self.data_type == 'float':
-                        line = list(map(np.float32,line))
-                    test_dataset.append(line)
-                    if i == int(self.nb_tests)-1:
-                        break
-            test_dataset = np.array(test_dataset)
-            f.close()
+        if self.test_dataset_file is None:
+            return []
 
-        except TypeError:
-            None
+        input_size = self.layers[0].size
 
-        return test_dataset
+        if self.nb_tests is None:
+            # Without a number of tests, all the samples of the file are used
+            if Path(self.test_dataset_file).suffix == '.npy':
+                self.nb_tests = len(np.load(self.test_dataset_file, mmap_mode='r'))
+            else:
+                with open(self.test_dataset_file, 'r') as f:
+                    self.nb_tests = sum(1 for line in f if line.strip())
+        nb_tests = int(self.nb_tests)
+
+        if Path(self.test_dataset_file).suffix == '.npy':
+            # Binary datasets are memory-mapped, one sample per row
+            test_dataset = np.load(self.test_dataset_file, mmap_mode='r')
+            test_dataset = test_dataset.reshape(len(test_dataset), input_size)[:nb_tests]
+            return np.asarray(test_dataset, dtype=self.data_type_py)
+
+        # Text datasets have one sample per line, written as [x0, x1, ...]
+        test_dataset = np.empty((nb_tests, input_size), dtype=self.data_type_py)
+        parse_type = np.int64 if np.issubdtype(self.data_type_py, np.integer) else np.float64
+        brackets = str.maketrans('[]', ' ,')
+        nb_samples = 0
+
+        with open(self.test_dataset_file, 'r') as f:
+            while nb_samples < nb_tests:
+                lines = list(islice(f, min(chunk_size, nb_tests - nb_samples)))
+                if not lines:
+                    break
+                # Each chunk of lines is parsed by a single call, as one comma-separated list of values
+                chunk = ''.join(lines).translate(brackets).rstrip().rstrip(',')
+                values = np.fromstring(chunk, dtype=parse_type, sep=',')
+                test_dataset[nb_samples:nb_samples + len(lines)] = values.reshape(len(lines), input_size)
+                nb_samples += len(lines)
+
+        return test_dataset[:nb_samples]
+
+    def compute_inference(self, c_files_directory, batch_size = 256, jobs = 1, output_format = 'txt'):
+        nn_output = None
+        # The dataset is processed batch_size samples at a time, each layer computing the whole chunk at once
+        chunks = (self.test_dataset[start:start + batch_size] for start in range(0, len(self.test_dataset), batch_size))
+        output_filename = 'output_python.' + output_format
+
+        if output_format == 'npy':
+            # The .npy file is allocated upfront, then filled by chunks through a memory map
+            fi = np.lib.format.open_memmap(os.path.join(c_files_directory, output_filename), mode='w+', dtype=self.data_type_py, shape=(len(self.test_dataset), self.layers[-1].size))
+        else:
+            fi = open(os.path.join(c_files_directory, output_filename), 'wb' if output_format == 'bin' else 'w+')
+
+        row = 0
+        if jobs > 1:
+            # Forked workers share the layers (and their weights) with the parent process until they are written,
+            # the chunks are returned in the dataset order and computed exactly as in the serial run
+            if 'fork' in multiprocessing.get_all_start_methods():
+                context = multiprocessing.get_context('fork')
+            else:
+                context = multiprocessing.get_context()
+            with context.Pool(jobs, initializer=init_inference_worker, initargs=(self.layers,)) as pool:
+                for nn_outputs in pool.imap(feedforward_layers, chunks):
+                    nn_output = self.write_inference_outputs(nn_outputs, fi, row, output_format)
+                    row += len(nn_outputs)
+        else:
+            for nn_inputs in chunks:
+                nn_outputs = feedforward_layers(nn_inputs, self.layers)
+                nn_output = self.write_inference_outputs(nn_outputs, fi, row, output_format)
+                row += len(nn_outputs)
+
+        if output_format == 'npy':
+            fi.flush()
+            del fi
+        else:
+            fi.close()
+
+        print("File " + output_filename + " generated.")
 
-    def compute_inference(self, c_files_directory):
-        with open(os.path.join(c_files_directory, 'output_python.txt'), 'w+') as fi:
-            for nn_input in self.test_dataset:
+        return nn_output
 
-                previous_layer_result = nn_input  # for the very first layer, it is the neural network input
+    def write_inference_outputs(self, nn_outputs, fi, row, output_format = 'txt'):
 
-                for layer in self.layers:
-                    current_layer_result = layer.feedforward(previous_layer_result)
-                    previous_layer_result = current_layer_result
+        if output_format == 'npy':
+            fi[row:row + len(nn_outputs)] = nn_outputs
+        elif output_format == 'bin':
+            # Raw values in the generated code data type, in the order of the C predictions array
+            fi.write(np.ascontiguousarray(nn_outputs, dtype=self.data_type_py).tobytes())
+        else:
+            # Write results in text files to compare prediction, one chunk at a time.
+            # Each line is formatted as the values followed by a space, then ' \n' (as the harness does).
+            line_format = '{:.9g} ' * nn_outputs.shape[1] + ' \n'
+            fi.write(''.join(line_format.format(*nn_output) for nn_output in nn_outputs.tolist()))
 
-                nn_output = current_layer_result
+        return nn_outputs[-1]
 
-                # print(nn_output) # write to file instead
+    def parse_activation_impl(self, activation_impl):
 
-                # Write results in text files to compare prediction.
+        implementations = ('libm', 'approx', 'lut')
+        activations = ('tanh', 'sigmoid', 'relu', 'linear')
 
-                nn_output = np.reshape(nn_output, -1)
-                for j in range(len(nn_output)):
-                    print('{:.9g}'.format(nn_output[j]), end=' ', file=fi, flush=True)
-                    # print(decimal.Decimal(nn_output[j]), end=' ', file=fi, flush=True)
-                print(" ",file=fi)
+        if '=' not in activation_impl:
+            if activation_impl not in implementations:
+                raise ValueError("Unknown activation function implementation: " + activation_impl + " (expected one of " + ", ".join(implementations) + ", or a comma separated list of activation=implementation).")
+            return dict.fromkeys(activations, activation_impl)
 
-        fi.close()
+        parsed = dict.fromkeys(activations, 'libm')
+        for item in activation_impl.split(','):
+            activation, _, implementation = item.partition('=')
+            if activation not in activations:
+                raise ValueError("Unknown activation function in --activation-impl: '" + item + "' (expected activation=implementation, the activation being one of " + ", ".join(activations) + ").")
+            if implementation not in implementations:
+                raise ValueError("Unknown activation function implementation in --activation-impl: '" + item + "' (expected one of " + ", ".join(implementations) + ").")
+            parsed[activation] = implementation
+        return parsed
 
-        print("File output_python.txt generated.")
+    def activation_implementation(self, activation_str):
 
-        return nn_output
+        return self.activation_implementations.get(activation_str, 'libm')
 
     def create_actv_function_obj(self, activation_str):
 
+        implementation = self.activation_implementation(activation_str)
+
         if activation_str == 'sigmoid':
-            return Sigmoid()
+            return Sigmoid(implementation)
         elif activation_str == 'relu':
-            return ReLu()
+            return ReLu(implementation)
         elif activation_str == 'tanh':
-            return TanH()
+            return TanH(implementation)
         elif activation_str == 'linear':
-            return Linear()
+            return Linear(implementation)
         elif activation_str == 'softmax':
             return Softmax()
 
     def flatten_array_orderc(self, array):
 
-        flattened_aray = array.flatten(order='C')
-        s = '\n        {'
-        for i in range(flattened_aray.size):
-            s += str(flattened_aray[i])+', '
-        s = s[:-2]
-        s+='}'
-
-        return s
+        return '\n        {' + format_c_literals(array, order='C') + '}'
 
     def flatten_array_orderf(self, array):
 
-        flattened_aray = array.flatten(order='F')
-        s = '\n        {'
-        for i in range(flattened_aray.size):
-            s += str(flattened_aray[i])+', '
-        s = s[:-2]
-        s+='}'
-
-        return s
+        return '\n        {' + format_c_literals(array, order='F') + '}'
 
     def flatten_array_hybrid(self, array):
 
@@ -217,77 +351,216 @@ class CodeGenerator(ABC):
 
         if ndim > 2:
             array = array.reshape(-1, *array.shape[-(ndim-2):])
-            flattened_aray = array.flatten(order='F')
-
-        else:
-            flattened_aray = array.flatten(order='F')
-
-        s = '\n        {'
-        for i in range(flattened_aray.size):
-            s += str(flattened_aray[i])+', '
-        s = s[:-2]
-        s+='}'
 
-        return s
+        return '\n        {' + format_c_literals(array, order='F') + '}'
 
     @abstractmethod
     def generate_c_files(self, c_files_directory, force=False):
         pass
 
+    def fuse_layers(self, first_class, second_class, fused_class):
+
+        # Each layer of first_class whose output is only read by a layer of second_class is replaced, with this
+        # layer, by a single fused_class layer: the output of the first layer is then neither stored nor planned
+        # in the arena
+        layers = []
+        for layer in self.layers:
+            previous = layers[-1] if layers else None
+            if isinstance(layer, second_class) and isinstance(previous, first_class) and previous.next_layer == [layer]:
+                layers[-1] = fused_class(previous, layer)
+            else:
+                layers.append(layer)
+        self.layers = layers
+
+        self.plan_activations_memory()
+
+    def plan_activations_memory(self):
+
+        # The outputs of the hidden layers share a single arena. The output of a layer lives from the layer
+        # producing it to the last layer reading it, the network input and the prediction are given by the caller.
+        planned = self.layers[1:-1]
+        last_use = {layer.idx: layer.idx for layer in planned}
+        for layer in self.layers:
+            for previous in layer.previous_layer:
+                if previous.idx in last_use:
+                    last_use[previous.idx] = max(last_use[previous.idx], layer.idx)
+
+        # Buffers to place as [layer, offset attribute, size, first use, last use], the scratch buffer of a layer
+        # only lives while the layer is computed
+        buffers = [[layer, 'offset', layer.size, layer.idx, last_use[layer.idx]] for layer in planned]
+        buffers += [[layer, 'scratch_offset', layer.scratch_size, layer.idx, layer.idx] for layer in self.layers if layer.scratch_size > 0]
+
+        # Greedy placement, largest buffers first, at the lowest offset which does not overlap
+        # the buffers already placed and alive at the same time
+        placed = []
+        for buffer in sorted(buffers, key=lambda b: (-b[2], b[3])):
+            layer, attribute, size, first_use, last_use = buffer
+            offset = 0
+            for other, other_offset in sorted(placed, key=lambda p: p[1]):
+                if other[3] > last_use or first_use > other[4]:
+                    continue
+                if offset + size <= other_offset:
+                    break
+                offset = max(offset, other_offset + other[2])
+            setattr(layer, attribute, offset)
+            placed.append((buffer, offset))
+
+        self.arena_size = max([offset + buffer[2] for buffer, offset in placed], default=1)
+
+    def generate_activation_definitions(self):
+
+        # The approximated activation functions are called by the inlined kernels, each one is defined once
+        definitions = {}
+        for layer in self.layers:
+            if hasattr(layer, 'activation_function') and layer.activation_function.implementation != 'libm':
+                definitions[layer.activation_function.name] = layer.activation_function.generate_c_inline_definition(self.data_type)
+
+        return ''.join(definitions.values())
+
+    def aligned(self):
+        # Alignment of the arena and of the weights, so that the vectors of the kernels do not straddle cache lines
+        return ' __attribute__((aligned(' + str(self.buffer_alignment) + ')))' if self.buffer_alignment else ''
+
+    def generate_arena_defines(self):
+
+        s = '#define arena_size ' + str(self.arena_size) + '\n'
+        for layer in self.layers[1:-1]:
+            s += '#define l' + str(layer.idx) + '_offset ' + str(layer.offset) + '\n'
+        for layer in self.layers:
+            if layer.scratch_size > 0:
+                s += '#define l' + str(layer.idx) + '_scratch_offset ' + str(layer.scratch_offset) + '\n'
+
+        return s + '\n'
+
+    def assign_buffers(self):
+
+        # Each layer reads the output of the previous one in place, so that no activation is ever copied:
+        # the first layer reads the network input and the last one writes the prediction directly
+        self.layers[0].input_buffer = self.layers[0].output_buffer = 'nn_input'
+        for layer in self.layers[1:]:
+            layer.input_buffer = layer.previous_layer[0].output_buffer
+            if layer is self.layers[-1]:
+                layer.output_buffer = 'prediction'
+            else:
+                layer.output_buffer = 'l' + str(layer.idx) + '_output'
+
+    def write_arena_declarations(self, block_size=None):
+
+        # All the buffers of a block of samples are block_size times larger, so that the single sample
+        # placement is scaled by block_size
+        scale = block_size + '*' if block_size else ''
+        self.source_file.write('    static ' + self.data_type + ' arena[' + scale + 'arena_size]' + self.aligned() + ';\n')
+        for layer in self.layers[1:-1]:
+            self.source_file.write('    ' + self.data_type + ' *' + layer.output_buffer + ' = arena + ' + scale + 'l' + str(layer.idx) + '_offset;\n')
+        for layer in self.layers:
+            if layer.scratch_size > 0:
+                self.source_file.write('    ' + self.data_type + ' *l' + str(layer.idx) + '_scratch = arena + ' + scale + 'l' + str(layer.idx) + '_scratch_offset;\n')
+
+    def testdataset_files(self):
+
+        if self.binary_dataset:
+            return ['test_dataset.h', 'test_dataset.bin']
+        else:
+            return ['test_dataset.h', 'test_dataset.c']
+
     def generate_testdataset_files(self):
 
         testdataset_header = open(self.c_files_directory + '/test_dataset.h' , "w+")
-        testdataset_source = open(self.c_files_directory + '/test_dataset.c' , "w+")
 
         s = '#ifndef TEST_DATASET_H_ \n'
         s += '#define TEST_DATASET_H_ \n\n'
-        s += '#define nb_samples ' + str(self.nb_tests) + '\n'
+        s += '#include <stdint.h>\n\n'
+        if not self.binary_dataset:
+            s += '#define nb_samples ' + str(self.nb_tests) + '\n'
         s += '#define nn_input_size ' + str(self.layers[0].size) + '\n'
         s += '#define nn_output_size ' + str(self.layers[-1].size) + '\n\n' # last element of layers_sizes, corresponding to the size of last layer.
-        s += 'extern '+ self.data_type + ' nn_test_inputs[nb_samples][nn_input_size];\n\n'
+        if not self.binary_dataset:
+            s += 'extern '+ self.data_type + ' nn_test_inputs[nb_samples][nn_input_size];\n\n'
         s += '#endif'
 
         testdataset_header.write(s)
 
+        if self.binary_dataset:
+            # Raw samples in the C data type, the number of samples is deduced from the file size at runtime
+            self.generate_testdataset_binary_file(self.c_files_directory + '/test_dataset.bin')
+            return
+
+        testdataset_source = open(self.c_files_directory + '/test_dataset.c' , "w+")
+
         t = '#include "test_dataset.h" \n\n'
         t += self.data_type + ' nn_test_inputs[nb_samples][nn_input_size] = {'
 
         if self.test_dataset is None:
             pass
         else:
-            for j in range(self.test_dataset.shape[0]):
-                t += self.flatten_array_orderc(self.test_dataset[j]) +','
-            t = t[:-1]
+            t += ','.join(self.flatten_array_orderc(sample) for sample in self.test_dataset)
 
         t += '};\n'
 
         testdataset_source.write(t)
 
+    def generate_testdataset_binary_file(self, path):
+
+        np.ascontiguousarray(self.test_dataset, dtype=self.data_type_py).tofile(path)
+
     def generate_main_file(self):
 
-        self.main_file.write('#include <stdio.h> \n#include <math.h> \n#include <time.h> \n#include "test_dataset.h" \n#include "inference.h"\n\n')
+        self.main_file.write('#include <stdio.h> \n#include <stdlib.h> \n#include <string.h> \n#include <math.h> \n#include <time.h> \n#include "test_dataset.h" \n#include "inference.h"\n\n')
         self.main_file.write('struct timeval GetTimeStamp();\n\n')
         self.main_file.write('int main(int argc, char** argv)\n{\n')
-        self.main_file.write('    char *path = argv[1];\n\n')
-        self.main_file.write('    FILE *fp = fopen(path, "w+");\n\n')
-        self.main_file.write('    '+self.data_type+' predictions[nb_samples][nn_output_size];\n\n')
+        self.main_file.write('    char *path = argv[1];\n')
+        self.main_file.write('    size_t path_length = strlen(path);\n')
+        self.main_file.write('    int binary_output = path_length > 4 && strcmp(path + path_length - 4, ".bin") == 0;\n\n')
+        self.main_file.write('    FILE *fp = fopen(path, binary_output ? "wb" : "w+");\n\n')
+        if self.binary_dataset:
+            self.main_file.write('    /* Test inputs are read from a raw binary file, the number of samples is deduced from its size */\n')
+            self.main_file.write('    char *dataset_path = argc > 2 ? argv[2] : "test_dataset.bin";\n')
+            self.main_file.write('    FILE *dataset = fopen(dataset_path, "rb");\n')
+            self.main_file.write('    if (dataset == NULL){\n')
+            self.main_file.write('        fprintf(stderr, "Cannot open test dataset %s\\n", dataset_path);\n')
+            self.main_file.write('        return 1;\n    }\n')
+            self.main_file.write('    fseek(dataset, 0, SEEK_END);\n')
+            self.main_file.write('    int nb_samples = ftell(dataset) / (nn_input_size * sizeof('+self.data_type+'));\n')
+            self.main_file.write('    fseek(dataset, 0, SEEK_SET);\n\n')
+            self.main_file.write('    '+self.data_type+' (*nn_test_inputs)[nn_input_size] = malloc(nb_samples * sizeof(*nn_test_inputs));\n')
+            self.main_file.write('    '+self.data_type+' (*predictions)[nn_output_size] = malloc(nb_samples * sizeof(*predictions));\n')
+            self.main_file.write('    if (fread(nn_test_inputs, sizeof(*nn_test_inputs), nb_samples, dataset) != nb_samples){\n')
+            self.main_file.write('        fprintf(stderr, "Cannot read test dataset %s\\n", dataset_path);\n')
+            self.main_file.write('        return 1;\n    }\n')
+            self.main_file.write('    fclose(dataset);\n\n')
+        else:
+            self.main_file.write('    '+self.data_type+' predictions[nb_samples][nn_output_size];\n\n')
         self.main_file.write('    clock_t t0 = clock();\n')
-        self.main_file.write('    for (int i = 0; i < nb_samples; ++i){\n')
-        self.main_file.write('        inference(predictions[i], nn_test_inputs[i]);\n    }\n')
+        if self.batch_block:
+            self.main_file.write('    inference_batch(predictions[0], nn_test_inputs[0], nb_samples);\n')
+        else:
+            self.main_file.write('    for (int i = 0; i < nb_samples; ++i){\n')
+            self.main_file.write('        inference(predictions[i], nn_test_inputs[i]);\n    }\n')
         self.main_file.write('    clock_t t1 = clock();\n\n')
         self.main_file.write('    printf("   Average time over %d tests: %e s \\n", nb_samples,\n')
         self.main_file.write('        (float)(t1-t0)/nb_samples/(float)CLOCKS_PER_SEC/(float)100);\n\n')
-        self.main_file.write('    printf("   ACETONE framework\'s inference output: \\n");\n')
-        self.main_file.write('    for (int i = 0; i < nb_samples; ++i){\n')
-        self.main_file.write('        for (int j = 0; j < nn_output_size; ++j){\n')
-        self.main_file.write('            fprintf(fp,"%.9g ", predictions[i][j]);\n')
-        self.main_file.write('            printf("%.9g ", predictions[i][j]);\n')
-        self.main_file.write('            if (j == nn_output_size - 1){\n')
-        self.main_file.write('                fprintf(fp, "\\n");\n')
-        self.main_file.write('                printf("\\n");\n')
-        self.main_file.write('            }\n        }\n    }\n\n')
+        self.main_file.write('    if (binary_output){\n')
+        self.main_file.write('        /* Raw predictions, in the layout read by acetone-diff for .bin files */\n')
+        self.main_file.write('        fwrite(predictions, sizeof(predictions[0][0]), nb_samples * nn_output_size, fp);\n')
+        self.main_file.write('    }\n    else {\n')
+        self.main_file.write('        printf("   ACETONE framework\'s inference output: \\n");\n')
+        self.main_file.write('        for (int i = 0; i < nb_samples; ++i){\n')
+        self.main_file.write('            for (int j = 0; j < nn_output_size; ++j){\n')
+        if np.issubdtype(self.data_type_py, np.integer):
+            self.main_file.write('                fprintf(fp,"%d ", (int)predictions[i][j]);\n')
+            self.main_file.write('                printf("%d ", (int)predictions[i][j]);\n')
+        else:
+            self.main_file.write('                fprintf(fp,"%.9g ", predictions[i][j]);\n')
+            self.main_file.write('                printf("%.9g ", predictions[i][j]);\n')
+        self.main_file.write('                if (j == nn_output_size - 1){\n')
+        self.main_file.write('                    fprintf(fp, "\\n");\n')
+        self.main_file.write('                    printf("\\n");\n')
+        self.main_file.write('                }\n            }\n        }\n    }\n\n')
         self.main_file.write('    fclose(fp);\n')
         self.main_file.write('    fp = NULL;\n\n')
+        if self.binary_dataset:
+            self.main_file.write('    free(nn_test_inputs);\n')
+            self.main_file.write('    free(predictions);\n\n')
         self.main_file.write('    return 0;\n}')
 
     def generate_makefile(self):
@@ -300,7 +573,7 @@ class CodeGenerator(ABC):
             else : pass
 
         self.makefile.write('CC = gcc\n')
-        self.makefile.write('CFLAGS = -g -w -lm\n\n')
+        self.makefile.write('CFLAGS = -g -w -lm' + (' -fopenmp' if self.openmp else '') + '\n\n')
         self.makefile.write('SRC = ' + ' '.join(source_files) + '\n')
         self.makefile.write('HEADERS = ' + ' '.join(header_files) + '\n')
         self.makefile.write('OBJ = $(SRC:.cc=.o) $(HEADERS)\n')
@@ -314,13 +587,13 @@ class CodeGenerator_V1(CodeGenerator):
     def __init__(self, **kwds):
         super().__init__(**kwds)
         self.version = 'v1'
-        self.files_to_gen = ['layers.c', 'layers.h', 'activation_functions.c', 'activation_functions.h', 'inference.c', 'inference.h', 'global_vars.c', 'main.c', 'Makefile']
+        self.files_to_gen = ['layers.c', 'layers.h', 'activation_functions.h', 'inference.c', 'inference.h', 'global_vars.c', 'main.c', 'Makefile']
 
     def generate_c_files(self, c_files_directory, force=False):
 
         self.c_files_directory = c_files_directory
 
-        testdataset_files = ['test_dataset.h', 'test_dataset.c']
+        testdataset_files = self.testdataset_files()
         self.files_to_gen.extend(testdataset_files)
 
         q = 0
@@ -338,7 +611,6 @@ class CodeGenerator_V1(CodeGenerator):
         else:
             self.layers_source_file = open(self.c_files_directory + '/layers.c' , "a+")
             self.layers_header_file = open(self.c_files_directory + '/layers.h' , "a+")
-            self.actvfunctions_source_file = open(self.c_files_directory + '/activation_functions.c' , "a+")
             self.actvfunctions_header_file = open(self.c_files_directory + '/activation_functions.h' , "a+")
             self.source_file = open(self.c_files_directory + '/inference.c' , "a+")
             self.header_file = open(self.c_files_directory + '/inference.h' , "a+")
@@ -365,23 +637,22 @@ class CodeGenerator_V1(CodeGenerator):
 
     def generate_layers_c_files(self):
 
-        self.layers_source_file.write('#include <stdio.h> \n#include <math.h> \n#include "layers.h" \n#include "inference.h"\n\n')
+        self.layers_source_file.write('#include <stdio.h> \n#include <math.h> \n#include "layers.h" \n#include "inference.h" \n#include "activation_functions.h"\n\n')
         self.layers_header_file.write('#ifndef LAYERS_H_ \n#define LAYERS_H_\n\n')
 
         layers_to_write = []
         for layer in self.layers:
-            if layer.name in layers_to_write:
+            if layer.kernel_name() in layers_to_write:
                 pass
             else:
-                layers_to_write.append(layer.name)
+                layers_to_write.append(layer.kernel_name())
                 layer.write_to_layer_c_files(self.data_type, self.version, self.layers_source_file, self.layers_header_file)
 
         self.layers_header_file.write('\n#endif')
 
     def generate_actvfunctions_c_files(self):
 
-        self.actvfunctions_source_file.write('#include <math.h> \n#include "activation_functions.h"\n\n')
-        self.actvfunctions_header_file.write('#ifndef ACTIVATIONS_H_\n#define ACTIVATIONS_H_\n\n')
+        self.actvfunctions_header_file.write('#ifndef ACTIVATIONS_H_\n#define ACTIVATIONS_H_\n\n#include <math.h>\n\n')
 
         activations_to_write = []
         for layer in self.layers:
@@ -390,7 +661,7 @@ class CodeGenerator_V1(CodeGenerator):
                     pass
                 else:
                     activations_to_write.append(layer.activation_function.name)
-                    layer.activation_function.generate_activation_c_files(self.data_type, self.actvfunctions_source_file, self.actvfunctions_header_file)
+                    layer.activation_function.generate_activation_c_files(self.data_type, self.actvfunctions_header_file)
 
             except AttributeError:
                 pass
@@ -401,16 +672,17 @@ class CodeGenerator_V1(CodeGenerator):
 
         self.source_file.write('#include <stdio.h> \n#include <math.h> \n#include "layers.h" \n#include "inference.h"\n\n')
         self.source_file.write('int inference('+self.data_type+' prediction[net[nb_layers-1].layer_size], '+self.data_type+' nn_input[net[0].layer_size])\n{\n')
-        self.source_file.write('    static '+self.data_type+' output_pre[l_size_max];\n')
-        self.source_file.write('    static '+self.data_type+' output_cur[l_size_max];\n\n')
-        self.source_file.write('    net[0].layer_type(0, nn_input, output_pre);\n\n')
-        self.source_file.write('    for (int i=1; i < nb_layers; ++i)\n    {\n\n')
-        self.source_file.write('        net[i].layer_type(i, output_pre, output_cur);\n\n')
-        self.source_file.write('        for (int j = 0; j < net[i].layer_size; ++j){\n')
-        self.source_file.write('            if (i < nb_layers-1){\n')
-        self.source_file.write('                output_pre[j] = output_cur[j];\n            }\n')
-        self.source_file.write('            else\n')
-        self.source_file.write('                prediction[j] = output_cur[j];\n        }\n    }\n')
+        self.source_file.write('    static '+self.data_type+' arena[arena_size];\n')
+        self.source_file.write('    '+self.data_type+' *input = nn_input;\n')
+        self.source_file.write('    '+self.data_type+' *output;\n\n')
+        self.source_file.write('    for (int i=1; i < nb_layers; ++i)\n    {\n')
+        self.source_file.write('        /* The layer outputs are placed in the arena, the last one writes the prediction */\n')
+        self.source_file.write('        if (i == nb_layers-1)\n')
+        self.source_file.write('            output = prediction;\n')
+        self.source_file.write('        else\n')
+        self.source_file.write('            output = arena + layer_offsets[i];\n\n')
+        self.source_file.write('        net[i].layer_type(i, input, output);\n')
+        self.source_file.write('        input = output;\n    }\n')
         self.source_file.write('    return 0;\n}')
 
     def generate_function_header_file(self):
@@ -439,6 +711,7 @@ class CodeGenerator_V1(CodeGenerator):
         self.header_file.write( '#define nb_layers ' + str(len(self.layers)) + '\n')
         self.header_file.write('#define nb_params_max 14 \n')
         self.header_file.write('#define l_size_max ' + str(self.l_size_max) + '\n')
+        self.header_file.write(self.generate_arena_defines())
         self.header_file.write('struct layer\n{\n')
         self.header_file.write('    int (*layer_type)(int, '+ self.data_type +'*, '+ self.data_type +'*);\n')
         self.header_file.write('    int layer_size;\n')
@@ -461,7 +734,8 @@ class CodeGenerator_V1(CodeGenerator):
         self.header_file.write('    '+ self.data_type + ' (*actv_function)('+ self.data_type +');\n};\n')
         self.header_file.write('\n')
 
-        self.header_file.write('extern struct layer net[nb_layers];\n\n')
+        self.header_file.write('extern struct layer net[nb_layers];\n')
+        self.header_file.write('extern const int layer_offsets[nb_layers];\n\n')
         self.header_file.write('int inference('+ self.data_type +' *prediction, '+ self.data_type +' *nn_input);\n\n')
         self.header_file.write('#endif')
 
@@ -473,7 +747,7 @@ class CodeGenerator_V1(CodeGenerator):
         for layer in self.layers:
             if hasattr(layer, 'weights'):
                 self.globalvars_file.write(self.data_type + ' weights_' + layer.name + '_' + str("{:02d}".format(layer.idx)) + '[' + str(layer.nb_weights) + '] = ' \
-                                        + self.flatten_array_orderc(layer.weights) + ';\n')
+                                        + self.flatten_array_orderc(layer.layout_weights()) + ';\n')
                 self.globalvars_file.write(self.data_type + ' biases_' + layer.name + '_' + str("{:02d}".format(layer.idx)) + '[' + str(layer.nb_biases) + '] = ' \
                                         + self.flatten_array_orderc(layer.biases) + ';\n\n')
 
@@ -484,7 +758,10 @@ class CodeGenerator_V1(CodeGenerator):
             layer.write_to_globalvars_file(self.version, self.data_type, self.globalvars_file)
 
         self.globalvars_file.write('};')
-        self.globalvars_file.write('\n')
+        self.globalvars_file.write('\n\n')
+
+        offsets = ['l' + str(layer.idx) + '_offset' for layer in self.layers[1:-1]]
+        self.globalvars_file.write('const int layer_offsets[nb_layers] = {0, ' + ', '.join(offsets + ['0']) + '};\n')
 
     def generate_flowfacts_guide(self, c_files_directory):
 
@@ -506,15 +783,6 @@ class CodeGenerator_V1(CodeGenerator):
         inference_function['inner'][0]['start'] = 1
         inference_function['inner'][0]['end'] = len(self.layers) - 1
 
-        inference_function['inner'][0]['inner'] = []
-        inference_function['inner'][0]['inner'].append({})
-        inference_function['inner'][0]['inner'][0]['type'] = 'for loop'
-        inference_function['inner'][0]['inner'][0]['variable'] = 'j'
-        inference_function['inner'][0]['inner'][0]['bound_sup'] = 'l_size_max'
-        inference_function['inner'][0]['inner'][0]['bound_min'] = 'l_size_min'
-        inference_function['inner'][0]['inner'][0]['start'] = 0
-        inference_function['inner'][0]['inner'][0]['end'] = (self.l_size_min -1), (self.l_size_max - 1)
-
         flowfacts_guide['functions'].append(inference_function)
 
         for layer in self.layers:
@@ -524,16 +792,38 @@ class CodeGenerator_V1(CodeGenerator):
 
 
 class CodeGenerator_V2(CodeGenerator):
-    def __init__(self, **kwds):
+    def __init__(self, filter_block = None, simd = None, fuse_pooling = False, fuse_softmax = False, **kwds):
         super().__init__(**kwds)
         self.version = 'v2'
+
+        if filter_block and simd:
+            raise ValueError("The packed filters and the vector kernels cannot be combined.")
+        if fuse_pooling and (filter_block or simd):
+            raise ValueError("The fused convolution and pooling kernels cannot be combined with the packed filters or the vector kernels.")
+        if fuse_softmax and simd:
+            raise ValueError("The fused Dense and Softmax kernels cannot be combined with the vector kernels.")
+
+        # Number of elements of the vectors of the kernels, written with the GCC vector extensions
+        self.simd = simd
+        if self.simd:
+            self.buffer_alignment = 64
+
+        for layer in self.layers:
+            if isinstance(layer, Conv2D):
+                layer.filter_block = filter_block
+            if isinstance(layer, (Dense, Conv2D, Pooling2D)):
+                layer.simd = simd
+        if fuse_pooling:
+            self.fuse_layers(Conv2D, Pooling2D, Conv2DPooling2D)
+        if fuse_softmax:
+            self.fuse_layers(Dense, Softmax, DenseSoftmax)
         self.files_to_gen = ['inference.c', 'inference.h', 'global_vars.c', 'main.c', 'Makefile']
 
     def generate_c_files(self, c_files_directory, force=False):
 
         self.c_files_directory = c_files_directory
 
-        testdataset_files = ['test_dataset.h', 'test_dataset.c']
+        testdataset_files = self.testdataset_files()
         self.files_to_gen.extend(testdataset_files)
 
         q = 0
@@ -570,17 +860,15 @@ class CodeGenerator_V2(CodeGenerator):
 
     def generate_function_source_file(self):
 
-        self.l_size_max = 1
-        for layer in (self.layers):
-            if layer.size > self.l_size_max : self.l_size_max = layer.size
+        self.assign_buffers()
 
         self.source_file.write('#include <stdio.h>\n')
         self.source_file.write('#include <math.h>\n')
         self.source_file.write('#include "inference.h"\n\n')
+        self.source_file.write(self.generate_activation_definitions())
 
         self.source_file.write('int inference(' + self.data_type + ' prediction[' + str(self.layers[-1].size) + '], ' + self.data_type + ' nn_input[' + str(self.layers[0].size) + '])\n{\n')
-        self.source_file.write('    static ' + self.data_type + ' output_pre[' + str(self.l_size_max) + '];\n')
-        self.source_file.write('    static ' + self.data_type + ' output_cur[' + str(self.l_size_max) + '];\n')
+        self.write_arena_declarations()
         self.source_file.write('    ' + self.data_type + ' dotproduct;\n')
         self.source_file.write('    ' + self.data_type + ' sum;\n')
         self.source_file.write('    ' + self.data_type + ' max;\n')
@@ -590,14 +878,6 @@ class CodeGenerator_V2(CodeGenerator):
 
             layer.write_to_function_source_file(self.data_type, self.version, self.source_file)
 
-            if layer.idx > 0:
-                self.source_file.write('    for (int k = 0; k < ' + str(layer.size) + '; ++k)\n')
-
-                if layer.idx == len(self.layers)-1:
-                    self.source_file.write('        prediction[k] = output_cur[k];\n\n')
-                else:
-                    self.source_file.write('        output_pre[k] = output_cur[k];\n\n')
-
         self.source_file.write('    return 0;\n}')
 
     def generate_function_header_file(self):
@@ -605,17 +885,25 @@ class CodeGenerator_V2(CodeGenerator):
         self.header_file.write('#ifndef INFERENCE_H_ \n')
         self.header_file.write('#define INFERENCE_H_ \n\n')
 
+        if self.simd:
+            self.header_file.write(self.generate_vector_types())
+
         self.nb_weights_max = 1
         self.nb_biases_max = 1
 
         for layer in self.layers:
             if hasattr(layer, 'weights'):
-                self.header_file.write('extern '+ self.data_type + ' weights_' + layer.name + '_' + str("{:02d}".format(layer.idx)) + '[' + str(layer.nb_weights) + '];\n')
-                self.header_file.write('extern '+ self.data_type + ' biases_' + layer.name + '_' + str("{:02d}".format(layer.idx)) + '[' + str(layer.nb_biases) + '];\n')
+                self.header_file.write('extern '+ self.data_type + ' weights_' + layer.name + '_' + str("{:02d}".format(layer.idx)) + '[' + str(layer.nb_weights) + ']' + self.aligned() + ';\n')
+                self.header_file.write('extern '+ self.data_type + ' biases_' + layer.name + '_' + str("{:02d}".format(layer.idx)) + '[' + str(layer.nb_biases) + ']' + self.aligned() + ';\n')
                 if layer.nb_weights > self.nb_weights_max : self.nb_weights_max = layer.nb_weights
                 if layer.nb_biases > self.nb_biases_max : self.nb_biases_max = layer.nb_biases
 
-        self.header_file.write('\nint inference('+ self.data_type +' *prediction, '+ self.data_type +' *nn_input);\n\n')
+        self.header_file.write('\n' + self.generate_arena_defines())
+        self.header_file.write('int inference('+ self.data_type +' *prediction, '+ self.data_type +' *nn_input);\n\n')
+        if self.batch_block:
+            self.header_file.write('#define batch_block_size ' + str(self.batch_block) + '\n\n')
+            self.header_file.write('/* Predictions of n samples, stored one after the other as their inputs */\n')
+            self.header_file.write('int inference_batch('+ self.data_type +' *predictions, '+ self.data_type +' *inputs, int n);\n\n')
         self.header_file.write('#endif')
 
     def generate_globalvars_file(self):
@@ -624,17 +912,34 @@ class CodeGenerator_V2(CodeGenerator):
 
         for layer in self.layers:
                 if hasattr(layer, 'weights'):
-                    self.globalvars_file.write(self.data_type + ' weights_' + layer.name + '_' + str("{:02d}".format(layer.idx)) + '[' + str(layer.nb_weights) + '] = ' \
-                                            + self.flatten_array_orderc(layer.weights) + ';\n')
-                    self.globalvars_file.write(self.data_type + ' biases_' + layer.name + '_' + str("{:02d}".format(layer.idx)) + '[' + str(layer.nb_biases) + '] = ' \
+                    self.globalvars_file.write(self.data_type + ' weights_' + layer.name + '_' + str("{:02d}".format(layer.idx)) + '[' + str(layer.nb_weights) + ']' + self.aligned() + ' = ' \
+                                            + self.flatten_array_orderc(layer.layout_weights()) + ';\n')
+                    self.globalvars_file.write(self.data_type + ' biases_' + layer.name + '_' + str("{:02d}".format(layer.idx)) + '[' + str(layer.nb_biases) + ']' + self.aligned() + ' = ' \
                                             + self.flatten_array_orderc(layer.biases) + ';\n\n')
 
+    def generate_vector_types(self):
+
+        # The vectors may be loaded from any element of a buffer: vec_t keeps the alignment of its elements
+        # (the accesses are still aligned whenever the index is a multiple of the width), vec_mask_t is the
+        # type of the comparisons of two vec_t
+        vector_bytes = str(self.simd) + '*sizeof(' + self.data_type + ')'
+        mask_type = 'int' if self.data_type == 'float' else 'long long'
+
+        s = 'typedef ' + self.data_type + ' vec_t __attribute__((vector_size(' + vector_bytes + '), aligned(sizeof(' + self.data_type + '))));\n'
+        s += 'typedef ' + mask_type + ' vec_mask_t __attribute__((vector_size(' + vector_bytes + ')));\n\n'
+        s += 'static inline vec_t vec_max(vec_t a, vec_t b)\n{\n'
+        s += '    vec_mask_t greater = a > b;\n'
+        s += '    return (vec_t)(((vec_mask_t)a & greater) | ((vec_mask_t)b & ~greater));\n}\n\n'
+
+        return s
+
 class CodeGenerator_V3(CodeGenerator_V2):
 
-    def __init__(self, **kwds):
+    def __init__(self, filter_block = None, simd = None, fuse_pooling = False, fuse_softmax = False, **kwds):
+        self.reject_options(filter_block=filter_block, simd=simd, fuse_pooling=fuse_pooling, fuse_softmax=fuse_softmax)
         super().__init__(**kwds)
         self.version = 'v3'
-        self.files_to_gen = ['inference.h', 'main.c', 'Makefile', 'test_dataset.h', 'test_dataset.c']
+        self.files_to_gen = ['inference.h', 'main.c', 'Makefile'] + self.testdataset_files()
 
     def generate_c_files(self, c_files_directory, force=False):
 
@@ -673,17 +978,15 @@ class CodeGenerator_V3(CodeGenerator_V2):
 
     def generate_function_source_file(self):
 
-        self.l_size_max = 1
-        for layer in (self.layers):
-            if layer.size > self.l_size_max : self.l_size_max = layer.size
+        self.assign_buffers()
 
         self.source_file.write('#include <stdio.h>\n')
         self.source_file.write('#include <math.h>\n')
         self.source_file.write('#include "inference.h"\n\n')
+        self.source_file.write(self.generate_activation_definitions())
 
         self.source_file.write('int inference(' + self.data_type + ' prediction[' + str(self.layers[-1].size) + '], ' + self.data_type + ' nn_input[' + str(self.layers[0].size) + '])\n{\n')
-        self.source_file.write('    static ' + self.data_type + ' output_pre[' + str(self.l_size_max) + '];\n')
-        self.source_file.write('    static ' + self.data_type + ' output_cur[' + str(self.l_size_max) + '];\n')
+        self.write_arena_declarations()
         self.source_file.write('    ' + self.data_type + ' dotproduct;\n')
         self.source_file.write('    ' + self.data_type + ' sum;\n')
         self.source_file.write('    ' + self.data_type + ' max;\n')
@@ -692,26 +995,250 @@ class CodeGenerator_V3(CodeGenerator_V2):
         for layer in self.layers:
             layer.write_to_function_source_file(self.data_type, self.version, self.source_file)
 
-            if layer.idx > 0:
-                for k in range(layer.size):
+        self.source_file.write('\n    return 0;\n}')
+
+    def generate_function_header_file(self):
 
-                    if layer.idx == len(self.layers)-1:
-                        self.source_file.write('    prediction['+str(k)+'] = output_cur['+str(k)+'];\n')
-                    else:
-                        self.source_file.write('    output_pre['+str(k)+'] = output_cur['+str(k)+'];\n')
+        self.header_file.write('#ifndef INFERENCE_H_ \n')
+        self.header_file.write('#define INFERENCE_H_ \n\n')
 
-                self.source_file.write('\n')
+        self.header_file.write(self.generate_arena_defines())
+        self.header_file.write('int inference('+ self.data_type +' *prediction, '+ self.data_type +' *nn_input);\n\n')
+        self.header_file.write('#endif')
 
-        self.source_file.write('\n    return 0;\n}')
+
+class GemmCodeGenerator(CodeGenerator_V2):
+    # Register tile (rows, columns) and cache blocks (rows, depth) of the matrix product kernel
+    gemm_tile = (4, 8)
+    gemm_blocks = (64, 256)
+
+    def __init__(self, filter_block = None, simd = None, batch_block = None, **kwds):
+        # The filters are packed by the matrix product itself, which is written for the compiler to vectorize
+        self.reject_options(filter_block=filter_block, simd=simd)
+        super().__init__(**kwds)
+        self.version = 'v8'
+        self.batch_block = batch_block
+
+        # The im2col matrices are scratch buffers of the activations arena
+        for layer in self.layers:
+            if isinstance(layer, Conv2D):
+                layer.scratch_size = layer.im2col_size()
+        self.plan_activations_memory()
+
+    def write_gemm_tile(self, rows, columns, indent, transposed_b):
+        t = self.data_type
+        s = indent + 'const ' + t + ' *a = A + i*K + kk;\n'
+        s += indent + 'const ' + t + ' *b = ' + ('B + j*K + kk' if transposed_b else 'B + kk*N + j') + ';\n'
+        for r in range(rows):
+            s += indent + t + ' ' + ', '.join('c' + str(r) + '_' + str(c) + ' = 0' for c in range(columns)) + ';\n'
+        s += '\n' + indent + 'for (int k = 0; k < kb; ++k)\n' + indent + '{\n'
+        for r in range(rows):
+            s += indent + '    ' + t + ' a' + str(r) + ' = a[' + str(r) + '*K + k];\n'
+        for c in range(columns):
+            s += indent + '    ' + t + ' b' + str(c) + ' = ' + ('b[' + str(c) + '*K + k]' if transposed_b else 'b[k*N + ' + str(c) + ']') + ';\n'
+        for r in range(rows):
+            s += indent + '    ' + ' '.join('c' + str(r) + '_' + str(c) + ' += a' + str(r) + '*b' + str(c) + ';' for c in range(columns)) + '\n'
+        s += indent + '}\n\n'
+        for r in range(rows):
+            s += indent + ' '.join('C[(i + ' + str(r) + ')*N + j + ' + str(c) + '] += c' + str(r) + '_' + str(c) + ';' for c in range(columns)) + '\n'
+
+        return s
+
+    def write_gemm_kernel(self, name='gemm', transposed_b=False):
+
+        mr, nr = self.gemm_tile
+        mc, kc = self.gemm_blocks
+        t = self.data_type
+
+        # C += A B with row-major A (M x K), B (K x N) and C (M x N). The depth is split in blocks of kc and the rows of A
+        # in blocks of mc, so that the block of A and the rows of B being multiplied stay in cache, each tile of mr x nr
+        # outputs is accumulated in registers. The last rows and columns are computed by thinner tiles.
+        s = '/* C += A ' + ('B^T' if transposed_b else 'B') + ', computed by cache blocks of ' + str(mc) + ' rows x ' + str(kc) + ' columns of A and register tiles of ' + str(mr) + ' x ' + str(nr) + ' outputs */\n'
+        s += 'static void ' + name + '(int M, int N, int K, const ' + t + ' *A, const ' + t + ' *B, ' + t + ' *C)\n{\n'
+        s += '    for (int kk = 0; kk < K; kk += ' + str(kc) + ')\n    {\n'
+        s += '        int kb = K - kk < ' + str(kc) + ' ? K - kk : ' + str(kc) + ';\n\n'
+        if self.openmp:
+            s += '        #pragma omp parallel for schedule(static)\n'
+        s += '        for (int ii = 0; ii < M; ii += ' + str(mc) + ')\n        {\n'
+        s += '            int ie = M - ii < ' + str(mc) + ' ? M : ii + ' + str(mc) + ';\n'
+        s += '            int j = 0;\n\n'
+        for columns, loop in ((nr, 'for (; j + ' + str(nr) + ' <= N; j += ' + str(nr) + ')'), (1, 'for (; j < N; ++j)')):
+            s += '            ' + loop + '\n            {\n'
+            s += '                int i = ii;\n\n'
+            s += '                for (; i + ' + str(mr) + ' <= ie; i += ' + str(mr) + ')\n                {\n'
+            s += self.write_gemm_tile(mr, columns, '                    ', transposed_b)
+            s += '                }\n'
+            s += '                for (; i < ie; ++i)\n                {\n'
+            s += self.write_gemm_tile(1, columns, '                    ', transposed_b)
+            s += '                }\n'
+            s += '            }\n'
+        s += '        }\n    }\n}\n\n'
+
+        return s
+
+    def generate_function_source_file(self):
+
+        self.assign_buffers()
+
+        self.source_file.write('#include <stdio.h>\n')
+        self.source_file.write('#include <math.h>\n')
+        self.source_file.write('#include "inference.h"\n\n')
+        self.source_file.write(self.generate_activation_definitions())
+
+        self.source_file.write(self.write_gemm_kernel())
+        if self.batch_block and any(isinstance(layer, Dense) for layer in self.layers):
+            # B^T is the output-major Dense weights (N x K)
+            self.source_file.write(self.write_gemm_kernel('gemm_nt', True))
+
+        self.source_file.write('int inference(' + self.data_type + ' prediction[' + str(self.layers[-1].size) + '], ' + self.data_type + ' nn_input[' + str(self.layers[0].size) + '])\n{\n')
+        self.write_arena_declarations()
+        self.source_file.write('    ' + self.data_type + ' dotproduct;\n')
+        self.source_file.write('    ' + self.data_type + ' sum;\n')
+        self.source_file.write('    ' + self.data_type + ' max;\n')
+        self.source_file.write('    int count;\n\n')
+
+        for layer in self.layers:
+
+            layer.write_to_function_source_file(self.data_type, self.version, self.source_file)
+
+        self.source_file.write('    return 0;\n}')
+
+        if self.batch_block:
+            self.generate_batch_functions()
+
+    def generate_batch_functions(self):
+
+        # Each layer is computed on a block of samples before the next one, so that its weights are read
+        # once per block: the convolutions and the Dense layers are single matrix products over the block
+        self.source_file.write('\n\nstatic int inference_block(' + self.data_type + ' *prediction, ' + self.data_type + ' *nn_input, int samples)\n{\n')
+        self.write_arena_declarations('batch_block_size')
+        self.source_file.write('    ' + self.data_type + ' dotproduct;\n')
+        self.source_file.write('    ' + self.data_type + ' sum;\n')
+        self.source_file.write('    ' + self.data_type + ' max;\n')
+        self.source_file.write('    int count;\n\n')
+
+        for layer in self.layers:
+
+            layer.write_batch_source(self.data_type, self.source_file, 'samples')
+
+        self.source_file.write('    return 0;\n}\n\n')
+
+        self.source_file.write('int inference_batch(' + self.data_type + ' *predictions, ' + self.data_type + ' *inputs, int n)\n{\n')
+        self.source_file.write('    for (int b = 0; b < n; b += batch_block_size)\n    {\n')
+        self.source_file.write('        int samples = n - b < batch_block_size ? n - b : batch_block_size;\n')
+        self.source_file.write('        inference_block(predictions + b*' + str(self.layers[-1].size) + ', inputs + b*' + str(self.layers[0].size) + ', samples);\n    }\n\n')
+        self.source_file.write('    return 0;\n}')
+
+
+class Int8CodeGenerator(CodeGenerator_V2):
+    # Straight-line code computing on int8 activations and weights (post-training quantization): the ranges of the
+    # activations are calibrated on the test dataset, the kernels accumulate in int32 and requantize their outputs
+    # with integer multipliers, so that the inference uses no floating point. The reference inference computes
+    # the same integers.
+
+    def __init__(self, filter_block = None, simd = None, fuse_pooling = False, fuse_softmax = False, batch_block = None, **kwds):
+        super().__init__(**kwds)
+        self.version = 'v9'
+
+        if filter_block or simd or fuse_pooling or fuse_softmax or batch_block:
+            raise ValueError("The int8 code cannot be combined with the packed filters, the vector kernels, the fused kernels or the batched inference.")
+        if len(self.test_dataset) == 0:
+            raise ValueError("The int8 code is calibrated on the test dataset, which is empty.")
+
+        self.quantize_network()
+
+    def quantize_network(self, chunk_size = 256):
+
+        # Range of the output of each layer (and of the pre-activation of the layers with weights) over the dataset
+        output_ranges = {}
+        preactivation_ranges = {}
+
+        def widen(ranges, layer, values):
+            low, high = ranges.get(layer.idx, (np.inf, -np.inf))
+            ranges[layer.idx] = (min(low, np.min(values)), max(high, np.max(values)))
+
+        float_outputs = []
+        for start in range(0, len(self.test_dataset), chunk_size):
+            values = self.test_dataset[start:start + chunk_size]
+            for layer in self.layers:
+                if hasattr(layer, 'preactivation'):
+                    preactivation = layer.preactivation(values)
+                    widen(preactivation_ranges, layer, preactivation)
+                    values = layer.activation_function.compute(preactivation)
+                else:
+                    values = layer.feedforward(values)
+                widen(output_ranges, layer, values)
+            float_outputs.append(np.reshape(values, (len(values), -1)))
+
+        for layer in self.layers:
+            layer.quantize(output_ranges[layer.idx], preactivation_ranges.get(layer.idx))
+
+        input_layer, output_layer = self.layers[0], self.layers[-1]
+        quantized_dataset = np.round(np.asarray(self.test_dataset, dtype=np.float64)/input_layer.output_scale) + input_layer.output_zero_point
+        self.test_dataset = np.clip(quantized_dataset, -128, 127).astype(np.int8)
+        self.data_type = 'int8_t'
+        self.data_type_py = np.int8
+
+        # Error of the dequantized int8 outputs against the float network
+        error = 0.0
+        for chunk, start in enumerate(range(0, len(self.test_dataset), chunk_size)):
+            outputs = feedforward_layers(self.test_dataset[start:start + chunk_size], self.layers)
+            dequantized = output_layer.output_scale*(outputs.astype(np.float64) - output_layer.output_zero_point)
+            error = max(error, np.max(np.abs(dequantized - float_outputs[chunk])))
+        print('Quantized to int8, maximum error of the dequantized outputs: ' + str(error))
+        print('The outputs are int8 values, to be compared by acetone-diff --precision int8.')
+
+    def generate_function_source_file(self):
+
+        self.assign_buffers()
+
+        self.source_file.write('#include <stdio.h>\n')
+        self.source_file.write('#include <stdint.h>\n')
+        self.source_file.write('#include "inference.h"\n\n')
+        self.source_file.write('/* round(acc*multiplier/2^shift), the halves being rounded up */\n')
+        self.source_file.write('static inline int32_t requantize(int32_t acc, int32_t multiplier, int shift)\n{\n')
+        self.source_file.write('    return (int32_t)(((int64_t)acc*multiplier + ((int64_t)1 << (shift - 1))) >> shift);\n}\n\n')
+        self.source_file.write('static inline int32_t saturate(int32_t x)\n{\n')
+        self.source_file.write('    return x < -128 ? -128 : (x > 127 ? 127 : x);\n}\n\n')
+
+        self.source_file.write('int inference(' + self.data_type + ' prediction[' + str(self.layers[-1].size) + '], ' + self.data_type + ' nn_input[' + str(self.layers[0].size) + '])\n{\n')
+        self.write_arena_declarations()
+        self.source_file.write('    int32_t acc;\n')
+        self.source_file.write('    int32_t sum;\n')
+        self.source_file.write('    int32_t max;\n')
+        self.source_file.write('    int count;\n\n')
+
+        for layer in self.layers:
+
+            layer.write_to_function_source_file(self.data_type, self.version, self.source_file)
+
+        self.source_file.write('    return 0;\n}')
 
     def generate_function_header_file(self):
 
         self.header_file.write('#ifndef INFERENCE_H_ \n')
         self.header_file.write('#define INFERENCE_H_ \n\n')
+        self.header_file.write('#include <stdint.h>\n\n')
 
+        for layer in self.layers:
+            for c_type, name, values in layer.quantized_parameters():
+                self.header_file.write('extern ' + c_type + ' ' + name + '[' + str(np.size(values)) + '];\n')
+
+        self.header_file.write('\n' + self.generate_arena_defines())
         self.header_file.write('int inference('+ self.data_type +' *prediction, '+ self.data_type +' *nn_input);\n\n')
         self.header_file.write('#endif')
 
+    def generate_globalvars_file(self):
+
+        self.globalvars_file.write('#include "inference.h" \n\n')
+
+        for layer in self.layers:
+            parameters = layer.quantized_parameters()
+            for c_type, name, values in parameters:
+                self.globalvars_file.write(c_type + ' ' + name + '[' + str(np.size(values)) + '] = ' + self.flatten_array_orderc(values) + ';\n')
+            if parameters:
+                self.globalvars_file.write('\n')
+
 
 class CodeGenerator_V4(CodeGenerator_V1):
     def __init__(self, **kwds):
@@ -734,7 +1261,7 @@ class CodeGenerator_V4(CodeGenerator_V1):
                 pass
 
         self.makefile.write(f'CC = nvcc\n')
-        self.makefile.write(f'CFLAGS = -g -w -lm\n\n')
+        self.makefile.write(f'CFLAGS = -g -w -lm' + (' -Xcompiler -fopenmp' if self.openmp else '') + '\n\n')
         self.makefile.write(f'SRC = {" ".join(source_files)} \n')
         self.makefile.write(f'HEADERS = {" ".join(header_files)} \n')
         self.makefile.write(f'OBJ = $(SRC:.cc=.o)\n')
@@ -749,9 +1276,11 @@ class TemplatedCodeGenerator(CodeGenerator):
     HEADER_SUFFIXES = (".h", ".hpp")
     SOURCE_SUFFIXES = (".c", ".cpp", ".cu")
 
-    def __init__(self, **kwds):
+    def __init__(self, specialized = False, **kwds):
         super().__init__(**kwds)
         self.version = 'v5'
+        # Instantiate each layer kernel with its compile-time parameters, instead of reading them from net[]
+        self.specialized = specialized
 
         # Collect used activation functions
         activation_functions: dict[str, ActivationFunctions] = {}
@@ -762,11 +1291,9 @@ class TemplatedCodeGenerator(CodeGenerator):
 
         # Collect templates
         self.template_fragments = {
-            "test_dataset.hpp": DatasetHeaderTemplate(self.data_type, self.nb_tests, self.layers[0].size, self.layers[-1].size),
-            "test_dataset.cpp": DatasetSourceTemplate(self.data_type, self.test_dataset),
-            "activation_functions.hpp": ActivationFunctionHeaderTemplate((f.generate_c_declaration(self.data_type) for f in activation_functions.values())),
-            "activation_functions.cpp": ActivationFunctionSourceTemplate( (f.generate_c_definition(self.data_type) for f in activation_functions.values())),
-            "inference.hpp": InferenceHeaderTemplate(self.layers),
+            "test_dataset.hpp": DatasetHeaderTemplate(self.data_type, self.nb_tests, self.layers[0].size, self.layers[-1].size, self.binary_dataset),
+            "activation_functions.hpp": ActivationFunctionHeaderTemplate((f.generate_c_inline_definition(self.data_type) for f in activation_functions.values())),
+            "inference.hpp": InferenceHeaderTemplate(self.layers, self.arena_size),
             "inference.cpp": InferenceSourceTemplate(self.data_type),
             "layers.hpp": LayersHeaderTemplate(
                 has_input=any(isinstance(i, InputLayer) for i in self.layers),
@@ -775,10 +1302,16 @@ class TemplatedCodeGenerator(CodeGenerator):
                 has_average_pooling2D=any(isinstance(i, AveragePooling2D) for i in self.layers),
                 has_dense=any(isinstance(i, Dense) for i in self.layers),
                 has_softmax=any(isinstance(i, Softmax) for i in self.layers),
+                openmp=self.openmp,
             ),
             "global_vars.cpp": GlobalsTemplate(self.layers, self.data_type),
-            "main.cpp": MainTemplate(self.data_type),
+            "main.cpp": MainTemplate(self.data_type, self.binary_dataset),
         }
+        if not self.binary_dataset:
+            self.template_fragments["test_dataset.cpp"] = DatasetSourceTemplate(self.data_type, self.test_dataset)
+        if self.specialized:
+            self.assign_buffers()
+            self.template_fragments["inference.cpp"] = SpecializedInferenceSourceTemplate(self.layers, self.data_type)
 
 
     def apply_template(self, template: TemplateSpec, renderer: Renderer, output_path: str | Path):
@@ -793,11 +1326,14 @@ class TemplatedCodeGenerator(CodeGenerator):
         #
         header_files = {Path(h).name for h in self.template_fragments.keys() if Path(h).suffix.lower() in self.HEADER_SUFFIXES}
         source_files = {Path(c).name for c in self.template_fragments.keys() if Path(c).suffix.lower() in self.SOURCE_SUFFIXES}
-        self.template_fragments["Makefile"] = MakefileTemplate(source_files, header_files, self.function_name, "nvcc")
+        self.template_fragments["Makefile"] = MakefileTemplate(source_files, header_files, self.function_name, "nvcc", self.openmp)
 
         for filename, template in self.template_fragments.items():
             self.apply_template(template, renderer, c_files_root / filename)
 
+        if self.binary_dataset:
+            self.generate_testdataset_binary_file(c_files_root / "test_dataset.bin")
+
 
 class MmaTemplatedCodeGenerator(TemplatedCodeGenerator):
     HEADER_SUFFIXES = (".h", ".hpp")
@@ -806,6 +1342,10 @@ class MmaTemplatedCodeGenerator(TemplatedCodeGenerator):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.version = "v6"
+        # Cross-checks emulate the fragment sizes used by the template
+        for layer in self.layers:
+            if isinstance(layer, Conv2D):
+                layer.mma_fragment = (32, 8, 16)
         self.template_fragments["layers.hpp"] = MmaLayersHeaderTemplate(
             has_input=any(isinstance(i, InputLayer) for i in self.layers),
             has_convolution2D=any(isinstance(i, Conv2D) for i in self.layers),
@@ -813,6 +1353,7 @@ class MmaTemplatedCodeGenerator(TemplatedCodeGenerator):
             has_average_pooling2D=any(isinstance(i, AveragePooling2D) for i in self.layers),
             has_dense=any(isinstance(i, Dense) for i in self.layers),
             has_softmax=any(isinstance(i, Softmax) for i in self.layers),
+            openmp=self.openmp,
         )
 
 class GpuMmaTemplatedCodeGenerator(TemplatedCodeGenerator):
@@ -822,6 +1363,8 @@ class GpuMmaTemplatedCodeGenerator(TemplatedCodeGenerator):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.version = "v7"
+        if self.specialized:
+            raise ValueError("The GPU convolution of v7 has no specialized kernel.")
         self.variant = kwargs.get("variant", "1")
         self.template_fragments["layers.hpp"] = GpuMmaLayersHeaderTemplate(
             variant = self.variant,
@@ -831,6 +1374,7 @@ class GpuMmaTemplatedCodeGenerator(TemplatedCodeGenerator):
             has_average_pooling2D=any(isinstance(i, AveragePooling2D) for i in self.layers),
             has_dense=any(isinstance(i, Dense) for i in self.layers),
             has_softmax=any(isinstance(i, Softmax) for i in self.layers),
+            openmp=self.openmp,
         )
 
         self.template_fragments["global_vars.cu"] = self.template_fragments["global_vars.cpp"]
@@ -3,7 +3,7 @@ import pystache
 
 from typing import Iterable
 
-from acetone.layers import Layers
+from acetone.layers import Layers, format_c_literals
 
 
 class MakefileTemplate(pystache.TemplateSpec):
@@ -15,19 +15,22 @@ class MakefileTemplate(pystache.TemplateSpec):
             header_files: Iterable[str],
             bin_name: str,
             compiler_name: str,
+            openmp: bool = False,
     ):
         self.source_files = list(source_files)
         self.header_files = list(header_files)
         self.bin_name = bin_name
         self.compiler = compiler_name
+        self.openmp = openmp
 
 
 # TODO Check if definition of the simple templates using a dataclass is possible
 class DatasetHeaderTemplate(pystache.TemplateSpec):
     template_name = "test_dataset_h"
 
-    def __init__(self, data_type: str, dataset_size: int, input_size: int, output_size: int):
+    def __init__(self, data_type: str, dataset_size: int, input_size: int, output_size: int, binary_dataset: bool = False):
         self.data_type = data_type
+        self.binary_dataset = binary_dataset
         self.dataset_size = dataset_size
         self.input_size = input_size
         self.output_size = output_size
@@ -38,28 +41,20 @@ class DatasetSourceTemplate(pystache.TemplateSpec):
 
     def __init__(self, data_type: str, dataset: np.array):
         self.data_type = data_type
-        self.dataset = []
-        for d in dataset:
-            self.dataset.append("{" + ", ".join(str(v) for v in d.flatten(order="C")) + "}")
+        self.dataset = ",\n        ".join("{" + format_c_literals(d) + "}" for d in dataset)
 
 
 class MainTemplate(pystache.TemplateSpec):
     template_name = "main_c"
 
-    def __init__(self, data_type: str):
+    def __init__(self, data_type: str, binary_dataset: bool = False):
         self.data_type = data_type
+        self.binary_dataset = binary_dataset
 
 
 class ActivationFunctionHeaderTemplate(pystache.TemplateSpec):
     template_name = "activation_function_h"
 
-    def __init__(self, activation_declarations: Iterable[str]):
-        self.declarations = activation_declarations
-
-
-class ActivationFunctionSourceTemplate(pystache.TemplateSpec):
-    template_name = "activation_function_c"
-
     def __init__(self, activation_definitions: Iterable[str]):
         self.definitions = activation_definitions
 
@@ -71,13 +66,46 @@ class InferenceSourceTemplate(pystache.TemplateSpec):
         self.data_type = data_type
 
 
+class SpecializedInferenceSourceTemplate(pystache.TemplateSpec):
+    template_name = "inference_specialized_c"
+
+    def __init__(self, layers: Iterable[Layers], data_type: str):
+        self.data_type = data_type
+        layers = list(layers)
+        self.planned_layers = [{"output": i.output_buffer, "idx": i.idx} for i in layers[1:-1]]
+        self.layers = []
+        # The input layer is not called, the first layer reads the network input
+        for i in layers[1:]:
+            descriptor = {}
+            descriptor["idx"] = i.idx
+            descriptor["inference_function"] = i.name
+            descriptor["input_idx"] = i.previous_layer[0].idx
+            descriptor["input"] = i.input_buffer
+            descriptor["output"] = i.output_buffer
+            if hasattr(i, "activation_function"):
+                descriptor["activation_function"] = i.activation_function.name
+            else:
+                descriptor["activation_function"] = False
+            if hasattr(i, "weights"):
+                descriptor["weights"] = {"var": "weights_{}_{:02d}" .format(i.name, i.idx), "size": str(i.nb_weights)}
+            else:
+                descriptor["weights"] = False
+            if hasattr(i, "biases"):
+                descriptor["biases"] = {"var": "biases_{}_{:02d}" .format(i.name, i.idx), "size": str(i.nb_biases)}
+            else:
+                descriptor["biases"] = False
+            self.layers.append(descriptor)
+
+
 class InferenceHeaderTemplate(pystache.TemplateSpec):
     template_name = "inference_h"
 
-    def __init__(self, layers):
+    def __init__(self, layers, arena_size: int):
         self.layers = layers
         self.nb_layers = len(layers)
         self.max_layer_size = max(i.size for i in layers)
+        self.arena_size = arena_size
+        self.planned_layers = layers[1:-1]
         self.max_layer_params = 14 # TODO Find where this magic number originates from
 
 
@@ -92,6 +120,7 @@ class LayersHeaderTemplate(pystache.TemplateSpec):
             has_average_pooling2D: bool = False,
             has_dense: bool = False,
             has_softmax: bool = False,
+            openmp: bool = False,
     ):
         self.has_input = has_input
         self.has_convolution2D = has_convolution2D
@@ -99,6 +128,7 @@ class LayersHeaderTemplate(pystache.TemplateSpec):
         self.has_average_pooling2D = has_average_pooling2D
         self.has_dense = has_dense
         self.has_softmax = has_softmax
+        self.openmp = openmp
 
 
 class MmaLayersHeaderTemplate(LayersHeaderTemplate):
@@ -133,11 +163,14 @@ class GlobalsTemplate(pystache.TemplateSpec):
 
     def __init__(self, layers: Iterable[Layers], data_type: str):
         self.data_type = data_type
+        layers = list(layers)
+        self.layer_offsets = ", ".join(["0"] + ["l{}_offset".format(i.idx) for i in layers[1:-1]] + ["0"])
         self.layers = []
         for i in layers:
             descriptor = {}
             descriptor["idx"] = i.idx
             descriptor["inference_function"] = i.name
+            descriptor["input_size"] = "l{}_size".format(i.previous_layer[0].idx) if i.previous_layer else "0x0"
             if hasattr(i, "activation_function"):
                 descriptor["activation_function"] = i.activation_function.name
             else:
@@ -146,16 +179,15 @@ class GlobalsTemplate(pystache.TemplateSpec):
                 descriptor["weights"] = {
                     "var": "weights_{}_{:02d}" .format(i.name, i.idx),
                     "size": str(i.nb_weights),
-                    "contents": "{" + ", ".join(str(v) for v in i.weights.flatten(order="C")) + "}",
+                    "contents": "{" + format_c_literals(i.layout_weights()) + "}",
                 }
             else:
                 descriptor["weights"] = False
             if hasattr(i, "biases"):
-                # TODO self.flatten_array_orderc(layer.weights)
                 descriptor["biases"] = {
                     "var": "biases_{}_{:02d}" .format(i.name, i.idx),
                     "size": str(i.nb_biases),
-                    "contents": "{" + ", ".join(str(v) for v in i.biases.flatten(order="C")) + "}",
+                    "contents": "{" + format_c_literals(i.biases) + "}",
                 }
             else:
                 descriptor["biases"] = False
@@ -0,0 +1,153 @@
+"""
+ *******************************************************************************
+ * ACETONE: Predictable programming framework for ML applications in safety-critical systems
+ * Copyright (c) 2022. ONERA
+ * This file is part of ACETONE
+ *
+ * ACETONE is free software ;
+ * you can redistribute it and/or modify it under the terms of the GNU Lesser General Public
+ * License as published by the Free Software Foundation ;
+ * either version 3 of  the License, or (at your option) any later version.
+ *
+ * ACETONE is distributed in the hope that it will be useful, but WITHOUT ANY WARRANTY ;
+ * without even the implied warranty of MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.
+ * See the GNU Lesser General Public License for more details.
+ *
+ * You should have received a copy of the GNU Lesser General Public License along with this program ;
+ * if not, write to the Free Software Foundation, Inc., 59 Temple Place, Suite 330, Boston, MA 02111-1307  USA
+ ******************************************************************************
+"""
+
+import json
+import math
+import shutil
+import subprocess
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+from acetone.cli_semantic_preservation import load_outputs
+from acetone.neural_network import CodeGenerator_V1
+
+# The generated code is compiled and run, then its outputs are compared with the reference inference
+pytestmark = pytest.mark.skipif(shutil.which('gcc') is None or shutil.which('make') is None, reason="gcc and make are needed to build the generated code")
+
+LENET = Path(__file__).parents[1] / 'data' / 'lenet5_trained' / 'lenet5_trained.json'
+NB_TESTS = 8
+
+
+@pytest.fixture
+def lenet_dataset(tmp_path):
+    dataset_file = tmp_path / 'test_input_lenet5.npy'
+    np.save(dataset_file, np.random.default_rng(0).random((NB_TESTS, 784), dtype=np.float32))
+    return dataset_file
+
+
+def write_model(model_file, input_shape, layers):
+    # Keras-like JSON description of a random model, the layers being given as (class_name, config) with the
+    # kernel_size/pool_size, strides and padding of each layer
+    rng = np.random.default_rng(0)
+    shape = input_shape
+    model = [{'class_name': 'InputLayer', 'config': {'dtype': 'float32', 'size': math.prod(shape)}}]
+    for class_name, config in layers:
+        height, width, channels = shape
+        if class_name == 'Conv2D':
+            kernel_size, filters = config['kernel_size'], config['filters']
+        else:
+            kernel_size, filters = config['pool_size'], channels
+        if config['padding'] == 'same':
+            shape = (math.ceil(height / config['strides']), math.ceil(width / config['strides']), filters)
+        else:
+            shape = ((height - kernel_size) // config['strides'] + 1, (width - kernel_size) // config['strides'] + 1, filters)
+        layer = {'class_name': class_name, 'config': {**config, 'strides': [config['strides']] * 2, 'size': math.prod(shape), 'input_shape': [None, height, width, channels], 'output_shape': [None, *shape]}}
+        if class_name == 'Conv2D':
+            layer['config'].update(kernel_size=[kernel_size] * 2, dilation_rate=[1, 1], activation='linear')
+            layer['weights'] = rng.standard_normal((kernel_size, kernel_size, channels, filters)).astype(np.float32).tolist()
+            layer['biases'] = rng.standard_normal(filters).astype(np.float32).tolist()
+        else:
+            layer['config'].update(pool_size=[kernel_size] * 2)
+        model.append(layer)
+    model.append({'class_name': 'Flatten', 'config': {}})
+    model.append({'class_name': 'Dense', 'config': {'units': 4, 'activation': 'linear'}, 'weights': rng.standard_normal((math.prod(shape), 4)).astype(np.float32).tolist(), 'biases': np.zeros(4, dtype=np.float32).tolist()})
+
+    with open(model_file, 'w') as f:
+        json.dump({'class_name': 'Sequential', 'config': {'name': Path(model_file).stem, 'layers': model}}, f)
+
+    dataset_file = Path(model_file).with_suffix('.npy')
+    np.save(dataset_file, rng.random((NB_TESTS, math.prod(input_shape)), dtype=np.float32))
+    return dataset_file
+
+
+def run_generated_code(c_files_directory, dataset_file, version, *options, model_file=LENET):
+    # The generator is run as acetone-codegen, whose process writes the files on exit
+    function_name = Path(model_file).stem
+    subprocess.run([sys.executable, '-m', 'acetone.cli_codegen', str(model_file), str(dataset_file), function_name, str(NB_TESTS), version, str(c_files_directory), *options], check=True, capture_output=True)
+    subprocess.run(['make'], cwd=c_files_directory, check=True, capture_output=True)
+    subprocess.run(['./' + function_name, 'output_c.txt'], cwd=c_files_directory, check=True, capture_output=True)
+
+
+@pytest.mark.parametrize('options', [(), ('--batch-block', '3')])
+def test_gemm_matches_reference(tmp_path, lenet_dataset, options):
+    run_generated_code(tmp_path, lenet_dataset, 'v8', *options)
+
+    reference = load_outputs(str(tmp_path / 'output_python.txt'), NB_TESTS, 'float')
+    outputs = load_outputs(str(tmp_path / 'output_c.txt'), NB_TESTS, 'float')
+    # The im2col + GEMM convolutions sum the products in another order than the reference
+    assert outputs.shape == reference.shape == (NB_TESTS, 10)
+    np.testing.assert_allclose(outputs, reference, rtol=0, atol=1e-5)
+
+
+def test_int8_matches_reference(tmp_path, lenet_dataset):
+    run_generated_code(tmp_path, lenet_dataset, 'v9')
+
+    reference = load_outputs(str(tmp_path / 'output_python.txt'), NB_TESTS, 'int8')
+    outputs = load_outputs(str(tmp_path / 'output_c.txt'), NB_TESTS, 'int8')
+    # The requantization is done with integer multipliers, so the C code computes the same integers as the reference
+    assert outputs.shape == reference.shape == (NB_TESTS, 10)
+    np.testing.assert_array_equal(outputs, reference)
+
+
+@pytest.mark.parametrize('version', ['v1', 'v2', 'v8'])
+def test_asymmetric_padding_convolution(tmp_path, version):
+    # A strided 'same' convolution of an 8x7 input: one more padding column than row, the kernels
+    # padding the rows by pad_left and the columns by pad_top
+    model_file = tmp_path / 'padding.json'
+    dataset_file = write_model(model_file, (8, 7, 2), [('Conv2D', {'filters': 3, 'kernel_size': 3, 'strides': 2, 'padding': 'same'})])
+    c_files_directory = tmp_path / 'code'
+    c_files_directory.mkdir()
+    run_generated_code(c_files_directory, dataset_file, version, '--cross-check', model_file=model_file)
+
+    reference = load_outputs(str(c_files_directory / 'output_python.txt'), NB_TESTS, 'float')
+    outputs = load_outputs(str(c_files_directory / 'output_c.txt'), NB_TESTS, 'float')
+    np.testing.assert_allclose(outputs, reference, rtol=0, atol=1e-4)
+
+
+@pytest.mark.parametrize('pooling', ['MaxPooling2D', 'AveragePooling2D'])
+@pytest.mark.parametrize('version', ['v1', 'v2'])
+def test_asymmetric_padding_pooling(tmp_path, pooling, version):
+    # A 'same' pooling of an 8x7 input (pad_left 1, pad_top 0), after a 'valid' convolution so that the
+    # pooled values are of both signs
+    model_file = tmp_path / 'padding.json'
+    dataset_file = write_model(model_file, (10, 9, 2), [('Conv2D', {'filters': 3, 'kernel_size': 3, 'strides': 1, 'padding': 'valid'}), (pooling, {'pool_size': 3, 'strides': 2, 'padding': 'same'})])
+    c_files_directory = tmp_path / 'code'
+    c_files_directory.mkdir()
+    run_generated_code(c_files_directory, dataset_file, version, model_file=model_file)
+
+    reference = load_outputs(str(c_files_directory / 'output_python.txt'), NB_TESTS, 'float')
+    outputs = load_outputs(str(c_files_directory / 'output_c.txt'), NB_TESTS, 'float')
+    np.testing.assert_allclose(outputs, reference, rtol=0, atol=1e-4)
+
+
+@pytest.mark.parametrize('activation_impl', ['tahn=lut', 'tanh', 'tanh=fast', 'tanh=lut,sigmoid'])
+def test_unknown_activation_impl(activation_impl):
+    with pytest.raises(ValueError, match='activation'):
+        CodeGenerator_V1(json_file=str(LENET), activation_impl=activation_impl)
+
+
+def test_dataset_without_nb_tests(lenet_dataset):
+    # All the samples of the dataset are used when the number of tests is not given
+    net = CodeGenerator_V1(json_file=str(LENET), test_dataset_file=str(lenet_dataset))
+    assert net.nb_tests == NB_TESTS
+    assert net.test_dataset.shape == (NB_TESTS, 784)